@@ -1,12 +1,12 @@
-from flask import Flask, request, jsonify, send_file, make_response
+from flask import Flask, Request, request, jsonify, send_file, make_response
 from flask_cors import CORS
 import weasyprint
 import tempfile
 import os
-import requests
 import io
 import json
-from PyPDF2 import PdfMerger
+import uuid
+from PyPDF2 import PdfReader, PdfWriter
 import base64
 import mimetypes
 from pathlib import Path
@@ -14,95 +14,256 @@ import logging
 import zipfile
 import time
 import re
-import hashlib
 import concurrent.futures
+import asyncio
+import threading
 from urllib.parse import urlparse
 from pdf_cache import PdfCache
+from cache_keys import cache_key, content_digest, template_version
+from gotenberg_client import GotenbergClient, AsyncGotenbergClient
+from single_flight import SingleFlight
+from image_pdf import image_to_pdf
+from pdf_check import pdf_is_locked, pdf_problem, repair_pdf
+from pdf_merge import PdfMergeEngine
+from attachments import EmailAttachment
+from html_scan import HtmlDocument
+from formats import (IMAGE_EXTENSIONS, OFFICE_EXTENSIONS, OFFICE_CONTAINER_TYPES, SAFE_EXTENSION_PATTERN, SNIFF_BYTES,
+                     file_extension, image_extension, image_mime_type, looks_like_text, sniff_content_type,
+                     sniff_magic)
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
 
+# Multipart uploads are spooled in memory up to this size per file part, then to a temp file
+UPLOAD_SPOOL_BYTES = int(os.environ.get('UPLOAD_SPOOL_MB', '1')) * 1024 * 1024
+
+class UploadRequest(Request):
+    """Request that spools each uploaded file part separately, so large attachments go to disk"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode='rb+')
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 CORS(app)
 
 # Gotenberg service URL
 GOTENBERG_URL = os.environ.get('GOTENBERG_URL', 'http://gotenberg:3000')
 
-# Temporary storage for individual PDFs
-temp_pdfs = {}
+# Keep-alive connections to Gotenberg per worker: every conversion thread and every request thread
+# can be waiting on Gotenberg at once, and connections beyond the pool size are closed after one use
+GOTENBERG_POOL_SIZE = int(
+    os.environ.get('GOTENBERG_POOL_SIZE') or
+    int(os.environ.get('CONVERSION_THREADS', '8')) + int(os.environ.get('THREADS', '8'))
+)
+
+# Shared keep-alive client used for every Gotenberg call
+gotenberg = GotenbergClient(
+    GOTENBERG_URL,
+    pool_size=GOTENBERG_POOL_SIZE,
+    max_retries=int(os.environ.get('GOTENBERG_MAX_RETRIES', '2'))
+)
+
+# Async conversion pipeline: /convert-with-attachments runs every conversion of an email
+# concurrently on one event loop per process instead of holding pool threads
+ASYNC_PIPELINE = os.environ.get('ASYNC_PIPELINE', 'false').lower() == 'true'
+async_gotenberg = AsyncGotenbergClient(
+    GOTENBERG_URL,
+    pool_size=GOTENBERG_POOL_SIZE,
+    max_retries=int(os.environ.get('GOTENBERG_MAX_RETRIES', '2'))
+) if ASYNC_PIPELINE else None
+
+# Temporary storage for individual PDFs, kept on disk so every worker process can serve downloads
+DOWNLOAD_DIR = Path(os.environ.get('DOWNLOAD_DIR') or Path(os.environ.get('CACHE_DIR') or tempfile.gettempdir()) / 'downloads')
+DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+PDF_ID_PATTERN = re.compile(r'^[A-Za-z0-9_]+$')
 
 # Initialize PDF cache
 # Use file-based cache if CACHE_DIR is set, otherwise use in-memory cache
+# CACHE_MAX_MB bounds the total size of cached PDFs (disk for file cache, RAM otherwise).
+# Worker processes share the file cache directory and the budget applies to the whole directory.
+# Merged PDFs are cached in a second tier with its own budget (MERGED_CACHE_MAX_MB), so large
+# merged files don't evict the component PDFs they are built from.
+# Whole-request results are small records in a third tier, pointing at PDFs in the other two.
 CACHE_DIR = os.environ.get('CACHE_DIR', None)
 if CACHE_DIR:
     cache_dir = Path(CACHE_DIR)
     cache_dir.mkdir(exist_ok=True)
+    cache_max_bytes = int(os.environ.get('CACHE_MAX_MB', '512')) * 1024 * 1024
     logger.info(f"Using file-based PDF cache in {CACHE_DIR}")
-    pdf_cache = PdfCache(cache_dir=CACHE_DIR, max_entries=200, ttl=3600*12)  # 12 hour TTL
+    pdf_cache = PdfCache(cache_dir=CACHE_DIR, max_entries=200, ttl=3600*12, max_bytes=cache_max_bytes)  # 12 hour TTL
+    merged_cache_max_bytes = int(os.environ.get('MERGED_CACHE_MAX_MB', '256')) * 1024 * 1024
+    merged_pdf_cache = PdfCache(cache_dir=str(cache_dir / 'merged'), max_entries=100, ttl=3600*12, max_bytes=merged_cache_max_bytes)
+    result_cache = PdfCache(cache_dir=str(cache_dir / 'results'), max_entries=1000, ttl=3600*12, max_bytes=4 * 1024 * 1024)
 else:
+    cache_max_bytes = int(os.environ.get('CACHE_MAX_MB', '64')) * 1024 * 1024
     logger.info("Using in-memory PDF cache")
-    pdf_cache = PdfCache(max_entries=50, ttl=3600*2)  # 2 hour TTL
+    pdf_cache = PdfCache(max_entries=50, ttl=3600*2, max_bytes=cache_max_bytes)  # 2 hour TTL
+    merged_cache_max_bytes = int(os.environ.get('MERGED_CACHE_MAX_MB', '32')) * 1024 * 1024
+    merged_pdf_cache = PdfCache(max_entries=20, ttl=3600*2, max_bytes=merged_cache_max_bytes)
+    result_cache = PdfCache(max_entries=200, ttl=3600*2, max_bytes=1024 * 1024)
+
+# Convert JPEG/PNG/GIF/BMP/WebP images to PDF in-process, Gotenberg only handles what the local engine can't
+LOCAL_IMAGE_PDF = os.environ.get('LOCAL_IMAGE_PDF', 'true').lower() == 'true'
+
+# Send CID inline images to Gotenberg as asset files next to index.html instead of inlining data: URLs
+INLINE_IMAGE_ASSETS = os.environ.get('INLINE_IMAGE_ASSETS', 'true').lower() == 'true'
+
+# Repair PDF attachments that fail the header/trailer check instead of leaving them out
+REPAIR_PDF_ATTACHMENTS = os.environ.get('REPAIR_PDF_ATTACHMENTS', 'true').lower() == 'true'
+
+# Merge the final PDF in-process ('local', Gotenberg is the fallback) or with Gotenberg first ('gotenberg')
+MERGE_ENGINE = os.environ.get('MERGE_ENGINE', 'local').lower()
+
+# Seconds to wait for a conversion before merging the PDFs that are ready: cache hits finish
+# within it, so a request served from the cache can use the merged-PDF cache before any merging
+MERGE_WAIT = 0.05
+
+# Version of the renderers behind Gotenberg, part of every conversion cache key: change it when
+# upgrading Gotenberg so PDFs rendered by the old version aren't served from the cache
+RENDERER_VERSION = os.environ.get('RENDERER_VERSION', 'gotenberg-8')
+
+# Render all extracted images of an email in one multi-page Chromium call instead of one call per image
+BATCH_IMAGES = os.environ.get('BATCH_IMAGES', 'true').lower() == 'true'
+
+# Table of in-flight conversions, so identical concurrent conversions run only once
+conversions_in_flight = SingleFlight()
 
 # Initialize thread pool executor for parallel processing
-thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=int(os.environ.get('CONVERSION_THREADS', '8')))
+# Maximum number of concurrent attachment/image conversions per email, so one large email can't fill the pool
+MAX_CONVERSIONS_PER_REQUEST = int(os.environ.get('MAX_CONVERSIONS_PER_REQUEST', '4'))
+
+def submit_bounded(calls, limit=None):
+    """
+    Submit calls to the thread pool, keeping at most `limit` of them running at once.
+    The next call is submitted when a running one finishes.
+    
+    Args:
+        calls: List of (fn, args) tuples
+        limit: Maximum number of calls in flight (default MAX_CONVERSIONS_PER_REQUEST)
+    
+    Returns:
+        list: One future per call, in the order of calls
+    """
+    limit = max(1, limit or MAX_CONVERSIONS_PER_REQUEST)
+    futures = [concurrent.futures.Future() for _ in calls]
+    pending = iter(list(zip(futures, calls)))
+    lock = threading.Lock()
+    
+    def submit_next():
+        while True:
+            with lock:
+                item = next(pending, None)
+            if item is None:
+                return
+            future, (fn, args) = item
+            # Skip calls cancelled before they started
+            if future.set_running_or_notify_cancel():
+                break
+        
+        def done(pool_future):
+            if pool_future.cancelled():
+                future.cancel()
+            elif pool_future.exception() is not None:
+                future.set_exception(pool_future.exception())
+            else:
+                future.set_result(pool_future.result())
+            submit_next()
+        
+        thread_pool.submit(fn, *args).add_done_callback(done)
+    
+    for _ in range(min(limit, len(calls))):
+        submit_next()
+    return futures
+
+# Background event loop running the async pipeline, started on first use in each worker process
+event_loop = None
+event_loop_lock = threading.Lock()
+
+def run_async(coro):
+    """Run a coroutine on the background event loop and wait for its result"""
+    global event_loop
+    with event_loop_lock:
+        if event_loop is None:
+            event_loop = asyncio.new_event_loop()
+            threading.Thread(target=event_loop.run_forever, name='async-pipeline', daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, event_loop).result()
 
 def cleanup_old_pdfs():
-    """Remove PDFs older than 1 hour to prevent memory leaks"""
+    """Remove PDFs older than 1 hour to prevent disk leaks"""
     current_time = time.time()
-    expired_ids = []
-    
-    for pdf_id, pdf_data in temp_pdfs.items():
-        # Handle both 'timestamp' and 'created_at' keys for backward compatibility
-        pdf_time = pdf_data.get('timestamp', pdf_data.get('created_at', 0))
-        if current_time - pdf_time > 3600:  # 1 hour
-            expired_ids.append(pdf_id)
     
-    for pdf_id in expired_ids:
-        del temp_pdfs[pdf_id]
-        logger.info(f"Cleaned up expired PDF: {pdf_id}")
+    for path in DOWNLOAD_DIR.glob('*.pdf'):
+        try:
+            if current_time - path.stat().st_mtime > 3600:  # 1 hour
+                path.unlink()
+                path.with_suffix('.json').unlink(missing_ok=True)
+                logger.info(f"Cleaned up expired PDF: {path.stem}")
+        except OSError:
+            pass
 
-def generate_pdf_id():
+def generate_pdf_id(prefix='pdf'):
     """Generate a unique PDF ID"""
-    return f"pdf_{int(time.time() * 1000)}_{len(temp_pdfs)}"
+    return f"{prefix}_{uuid.uuid4().hex}"
+
+def store_temp_pdf(pdf_id, pdf_content, filename):
+    """Store a PDF for later download via /download-pdf/<pdf_id>"""
+    pdf_path = DOWNLOAD_DIR / f"{pdf_id}.pdf"
+    tmp_path = DOWNLOAD_DIR / f"{pdf_id}.pdf.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(pdf_content)
+    os.replace(tmp_path, pdf_path)
+    with open(DOWNLOAD_DIR / f"{pdf_id}.json", 'w') as f:
+        json.dump({'filename': filename, 'created_at': time.time()}, f)
+
+def load_temp_pdf(pdf_id):
+    """Get (path, filename) of a stored PDF, or None if not found or expired"""
+    if not PDF_ID_PATTERN.match(pdf_id):
+        return None
+    pdf_path = DOWNLOAD_DIR / f"{pdf_id}.pdf"
+    try:
+        with open(DOWNLOAD_DIR / f"{pdf_id}.json") as f:
+            metadata = json.load(f)
+        if time.time() - metadata['created_at'] > 3600 or not pdf_path.exists():
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return pdf_path, metadata['filename']
+
+def warm_up():
+    """Prepare a worker before its first request: open Gotenberg connections"""
+    if gotenberg.warm_up(connections=min(4, gotenberg.pool_size)):
+        logger.info("Gotenberg connection pool warmed up")
+    else:
+        logger.warning("Gotenberg not reachable during warm-up")
 
-def extract_images_from_html(html_content):
-    """Extract embedded images from HTML content"""
+def extract_images_from_html(document):
+    """Extract embedded images from the <img> tags of a scanned HTML document"""
     try:
         logger.info("Extracting embedded images from HTML content...")
         images = []
         
-        # Pattern to match img tags with src attributes (data URLs and regular URLs)
-        img_pattern = r'<img[^>]*src=["\']([^"\']+)["\'][^>]*>'
-        img_matches = re.findall(img_pattern, html_content, re.IGNORECASE)
-        
-        for i, src in enumerate(img_matches):
+        # img src values (data URLs and regular URLs), found when the HTML was scanned
+        for i, image_source in enumerate(document.images):
+            src = image_source.value
             try:
                 if src.startswith('data:'):
                     # Handle data URLs (base64 embedded images)
                     logger.info(f"Found embedded data URL image {i+1}")
                     
                     # Extract the data URL components
-                    data_url_pattern = r'data:([^;]+);base64,(.+)'
-                    match = re.match(data_url_pattern, src)
+                    data_url = image_source.data_url()
                     
-                    if match:
-                        mime_type = match.group(1)
-                        base64_data = match.group(2)
+                    if data_url:
+                        mime_type, base64_data = data_url
                         
                         try:
                             # Decode base64 data
                             image_data = base64.b64decode(base64_data)
                             
                             # Determine file extension from MIME type
-                            extension = {
-                                'image/jpeg': '.jpg',
-                                'image/jpg': '.jpg',
-                                'image/png': '.png',
-                                'image/gif': '.gif',
-                                'image/bmp': '.bmp',
-                                'image/webp': '.webp'
-                            }.get(mime_type, '.jpg')
+                            extension = image_extension(mime_type)
                             
                             filename = f"embedded_image_{i+1}{extension}"
                             
@@ -118,7 +279,7 @@ def extract_images_from_html(html_content):
                         except Exception as e:
                             logger.warning(f"Failed to decode base64 image {i+1}: {str(e)}")
                             
-                elif src.startswith('cid:'):
+                elif image_source.cid is not None:
                     # Handle CID references (Content-ID attachments)
                     logger.info(f"Found CID reference: {src} - skipping (should be handled as attachment)")
                     
@@ -136,113 +297,207 @@ def extract_images_from_html(html_content):
         logger.error(f"Error extracting images from HTML: {str(e)}")
         return []
 
-def convert_image_to_pdf_with_gotenberg(image_data, filename, mime_type):
+def image_data_uri(image_data, filename, mime_type):
+    """Build the data: URI for an image, sniffing its MIME type from the bytes or filename if needed"""
+    # Handle different input types - image_data could be binary data or already base64
+    if isinstance(image_data, bytes):
+        # Binary image data - encode to base64
+        base64_image = base64.b64encode(image_data).decode('utf-8')
+    else:
+        # Assume it's already base64 encoded
+        base64_image = image_data
+
+    # If mime_type is not provided or doesn't look like an image type, detect it
+    # from the magic bytes, then the filename extension (JPEG if unknown)
+    mime_type = image_mime_type(mime_type, filename, image_data[:SNIFF_BYTES] if isinstance(image_data, bytes) else None)
+
+    logger.info(f"Using MIME type: {mime_type} for image {filename}")
+    return f"data:{mime_type};base64,{base64_image}"
+
+# Gotenberg form fields for image pages: Letter paper, 0.5in margins
+IMAGE_PAGE_OPTIONS = {
+    'paperWidth': '8.5',
+    'paperHeight': '11',
+    'marginTop': '0.5',
+    'marginBottom': '0.5',
+    'marginLeft': '0.5',
+    'marginRight': '0.5',
+    'printBackground': 'true',
+    'preferCSSPageSize': 'false',
+    'waitDelay': '100ms',  # Reduced wait time for images
+    'scale': 1.0          # No scaling
+}
+
+def build_image_request(image_data, filename, mime_type):
+    """Build the Gotenberg Chromium form (files, data) that renders an image on a page"""
+    data_uri = image_data_uri(image_data, filename, mime_type)
+
+    # Create HTML wrapper for the image
+    html_content = f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="UTF-8">
+        <style>
+            @page {{
+                size: A4;
+                margin: 0;
+            }}
+            body {{
+                margin: 0;
+                padding: 0;
+                width: 100vw;
+                height: 100vh;
+                display: flex;
+                justify-content: center;
+                align-items: center;
+            }}
+            img {{
+                max-width: 100vw;
+                max-height: 100vh;
+                width: auto;
+                height: auto;
+                object-fit: contain;
+            }}
+        </style>
+    </head>
+    <body>
+        <img src="{data_uri}" alt="{filename}" />
+    </body>
+    </html>
+    """
+
+    # Use Gotenberg to convert HTML to PDF
+    files = {
+        'files': ('index.html', html_content, 'text/html')
+    }
+    
+    return files, dict(IMAGE_PAGE_OPTIONS)
+
+def build_image_batch_request(images):
+    """
+    Build one Gotenberg Chromium form (files, data) that renders every image on its own page.
+    
+    Args:
+        images: List of (image_data, filename, mime_type, content_hash) tuples, in page order
+    """
+    pages = "\n".join(
+        f'<div class="page"><img src="{image_data_uri(image_data, filename, mime_type)}" alt="{filename}" /></div>'
+        for image_data, filename, mime_type, _ in images
+    )
+
+    # Same layout as build_image_request, with one full-height page box per image
+    html_content = f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="UTF-8">
+        <style>
+            @page {{
+                size: A4;
+                margin: 0;
+            }}
+            body {{
+                margin: 0;
+                padding: 0;
+            }}
+            .page {{
+                width: 100vw;
+                height: 100vh;
+                overflow: hidden;
+                display: flex;
+                justify-content: center;
+                align-items: center;
+                page-break-after: always;
+                break-after: page;
+            }}
+            .page:last-child {{
+                page-break-after: auto;
+                break-after: auto;
+            }}
+            img {{
+                max-width: 100vw;
+                max-height: 100vh;
+                width: auto;
+                height: auto;
+                object-fit: contain;
+            }}
+        </style>
+    </head>
+    <body>
+        {pages}
+    </body>
+    </html>
+    """
+
+    files = {
+        'files': ('index.html', html_content, 'text/html')
+    }
+    
+    return files, dict(IMAGE_PAGE_OPTIONS)
+
+# Version of the image page templates and options, single and batched images share cache entries
+IMAGE_TEMPLATE_VERSION = template_version(
+    RENDERER_VERSION,
+    build_image_request(b'', 'image', 'image/png'),
+    build_image_batch_request([(b'', 'image', 'image/png', None)])
+)
+
+def image_cache_key(image_data, mime_type, content_hash=None):
+    """
+    Cache key for an image page: the digest of the whole image (binary, or base64 text)
+    and its MIME type. content_hash is the content_digest of binary image_data if the caller has it.
+    """
+    digest = content_hash if content_hash and isinstance(image_data, bytes) else content_digest(image_data)
+    return cache_key('chromium-image', IMAGE_TEMPLATE_VERSION, digest, mime=mime_type)
+
+def convert_image_to_pdf_locally(image_data, filename):
+    """Convert an image to PDF with the local engine, returns None if it can't handle the image"""
+    if not LOCAL_IMAGE_PDF:
+        return None
+    try:
+        image_bytes = image_data if isinstance(image_data, bytes) else base64.b64decode(image_data)
+    except Exception:
+        return None
+    pdf_content = image_to_pdf(image_bytes)
+    if pdf_content:
+        logger.info(f"✓ Converted image {filename} to PDF locally ({len(pdf_content)} bytes)")
+    return pdf_content
+
+def convert_image_to_pdf_with_gotenberg(image_data, filename, mime_type, content_hash=None):
     """Convert an image to PDF using Gotenberg's Chromium route with caching"""
+    # Local conversion takes milliseconds, cheaper than a cache lookup of its result
+    pdf_content = convert_image_to_pdf_locally(image_data, filename)
+    if pdf_content:
+        return pdf_content
+    image_key = image_cache_key(image_data, mime_type, content_hash)
+    cache_hash = pdf_cache.key_for(image_key)
+    # If the same image is already being converted, wait for that result instead
+    return conversions_in_flight.do(
+        cache_hash, _convert_image_to_pdf_with_gotenberg, image_data, filename, mime_type, image_key, cache_hash
+    )
+
+def _convert_image_to_pdf_with_gotenberg(image_data, filename, mime_type, image_key, cache_hash):
+    """Image conversion for convert_image_to_pdf_with_gotenberg, run once per in-flight cache key"""
     try:
-        # Create a unique cache key for this image
-        if isinstance(image_data, bytes):
-            cache_key = image_data  # Use binary data directly for hashing
-        else:
-            # If it's base64, we need to add some context to ensure unique hashing
-            cache_key = f"{filename}:{mime_type}:{image_data[:100]}"
-        
         # Check if we have this image in cache
-        cached_pdf = pdf_cache.get(cache_key)
+        cached_pdf = pdf_cache.get(image_key, cache_hash)
         if cached_pdf:
             logger.info(f"Using cached PDF for image {filename} ({len(cached_pdf)} bytes)")
             return cached_pdf
             
         logger.info(f"Converting image {filename} to PDF using Gotenberg")
         
-        # Handle different input types - image_data could be binary data or already base64
-        if isinstance(image_data, bytes):
-            # Binary image data - encode to base64
-            base64_image = base64.b64encode(image_data).decode('utf-8')
-        else:
-            # Assume it's already base64 encoded
-            base64_image = image_data
-        
-        # If mime_type is not provided or doesn't look like an image type, try to detect it
-        if not mime_type or not mime_type.startswith('image/'):
-            # Try to detect from filename extension
-            file_ext = Path(filename).suffix.lower()
-            mime_type = {
-                '.jpg': 'image/jpeg',
-                '.jpeg': 'image/jpeg', 
-                '.png': 'image/png',
-                '.gif': 'image/gif',
-                '.bmp': 'image/bmp',
-                '.webp': 'image/webp'
-            }.get(file_ext, 'image/jpeg')  # Default to JPEG if unknown
-            
-        logger.info(f"Using MIME type: {mime_type} for image {filename}")
-        
-        # Create HTML wrapper for the image
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <style>
-                @page {{
-                    size: A4;
-                    margin: 0;
-                }}
-                body {{
-                    margin: 0;
-                    padding: 0;
-                    width: 100vw;
-                    height: 100vh;
-                    display: flex;
-                    justify-content: center;
-                    align-items: center;
-                }}
-                img {{
-                    max-width: 100vw;
-                    max-height: 100vh;
-                    width: auto;
-                    height: auto;
-                    object-fit: contain;
-                }}
-            </style>
-        </head>
-        <body>
-            <img src="data:{mime_type};base64,{base64_image}" alt="{filename}" />
-        </body>
-        </html>
-        """
-        
-        # Use Gotenberg to convert HTML to PDF
-        files = {
-            'files': ('index.html', html_content, 'text/html')
-        }
+        files, data = build_image_request(image_data, filename, mime_type)
         
-        data = {
-            'paperWidth': '8.5',
-            'paperHeight': '11',
-            'marginTop': '0.5',
-            'marginBottom': '0.5',
-            'marginLeft': '0.5',
-            'marginRight': '0.5',
-            'printBackground': 'true',
-            'preferCSSPageSize': 'false',
-            'waitDelay': '100ms',  # Reduced wait time for images
-            'scale': 1.0          # No scaling
-        }
-        
-        response = requests.post(
-            f"{GOTENBERG_URL}/forms/chromium/convert/html",
-            files=files,
-            data=data,
-            timeout=30
-        )
+        response = gotenberg.post('chromium_html', files=files, data=data)
         
         if response.status_code == 200:
             pdf_content = response.content
             logger.info(f"✓ Successfully converted image {filename} to PDF ({len(pdf_content)} bytes)")
             
             # Store in cache for future use
-            pdf_cache.put(cache_key, pdf_content)
+            pdf_cache.put(image_key, pdf_content, cache_hash)
             
             return pdf_content
         else:
@@ -253,16 +508,120 @@ def convert_image_to_pdf_with_gotenberg(image_data, filename, mime_type):
         logger.error(f"✗ Exception converting image {filename} to PDF: {str(e)}")
         return None
 
-def is_embedded_image(attachment, html_content):
-    """Check if an attachment is an embedded image (referenced by CID in HTML)"""
+def split_pdf_pages(pdf_content):
+    """Split a PDF into one single-page PDF per page"""
+    reader = PdfReader(io.BytesIO(pdf_content))
+    pages = []
+    for page in reader.pages:
+        writer = PdfWriter()
+        writer.add_page(page)
+        output_stream = io.BytesIO()
+        writer.write(output_stream)
+        pages.append(output_stream.getvalue())
+    return pages
+
+def split_image_batch(images, keys, pdf_content):
+    """
+    Split a batch render into per-image PDFs and cache each one under its own image key.
+    
+    Returns:
+        list: One PDF per image, or None if the page count doesn't match the images
+    """
+    try:
+        pages = split_pdf_pages(pdf_content)
+    except Exception as e:
+        logger.error(f"✗ Could not split batched image PDF: {str(e)}")
+        return None
+    
+    if len(pages) != len(images):
+        logger.warning(f"Batched image PDF has {len(pages)} pages for {len(images)} images, converting one by one")
+        return None
+    
+    for (image_key, cache_hash), page in zip(keys, pages):
+        pdf_cache.put(image_key, page, cache_hash)
+    return pages
+
+def convert_images_to_pdf_batch(images):
+    """
+    Convert several images to PDFs with one Gotenberg Chromium call, one page per image.
+    Images already in the cache are served from it; each rendered page is cached
+    separately, so a re-sent image is a cache hit whether it arrives alone or in a batch.
+    
+    Args:
+        images: List of (image_data, filename, mime_type, content_hash) tuples, content_hash may be None
+    
+    Returns:
+        tuple: (one PDF per image in order, None for images still to convert,
+                indexes of the images to convert one by one: a single miss, or all misses of a failed batch)
+    """
+    results = [None] * len(images)
+    missing = []
+    for i, (image_data, filename, mime_type, content_hash) in enumerate(images):
+        results[i] = convert_image_to_pdf_locally(image_data, filename)
+        if results[i]:
+            continue
+        image_key = image_cache_key(image_data, mime_type, content_hash)
+        cache_hash = pdf_cache.key_for(image_key)
+        cached_pdf = pdf_cache.get(image_key, cache_hash)
+        if cached_pdf:
+            logger.info(f"Using cached PDF for image {filename} ({len(cached_pdf)} bytes)")
+            results[i] = cached_pdf
+        else:
+            missing.append((i, (image_key, cache_hash)))
+    
+    if len(missing) > 1:
+        batch = [images[i] for i, _ in missing]
+        logger.info(f"Converting {len(batch)} images to PDF in one Gotenberg call")
+        pages = None
+        try:
+            files, data = build_image_batch_request(batch)
+            response = gotenberg.post('chromium_html', files=files, data=data)
+            if response.status_code == 200:
+                logger.info(f"✓ Successfully converted {len(batch)} images to PDF ({len(response.content)} bytes)")
+                pages = split_image_batch(batch, [keys for _, keys in missing], response.content)
+            else:
+                logger.error(f"✗ Failed to convert image batch to PDF: {response.status_code}")
+        except Exception as e:
+            logger.error(f"✗ Exception converting image batch to PDF: {str(e)}")
+        
+        if pages:
+            for (i, _), page in zip(missing, pages):
+                results[i] = page
+            missing = []
+    
+    return results, [i for i, _ in missing]
+
+def image_batch_futures(batch_future, images):
+    """
+    Turn the future of a convert_images_to_pdf_batch call into one future per image. Images the
+    batch left to convert one by one are submitted to the thread pool (see submit_bounded).
+    """
+    try:
+        results, missing = batch_future.result()
+    except Exception as e:
+        results, missing = [e] * len(images), []
+    fallback = dict(zip(missing, submit_bounded([(convert_image_to_pdf_with_gotenberg, images[i]) for i in missing])))
+    futures = []
+    for i, result in enumerate(results):
+        future = fallback.get(i)
+        if future is None:
+            future = concurrent.futures.Future()
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        futures.append(future)
+    return futures
+
+def is_embedded_image(attachment, document):
+    """Check if an attachment is an embedded image (referenced by CID in the scanned HTML document)"""
     try:
         # Check if the attachment name or content is referenced as a CID in the HTML
-        filename = attachment.get('name', '')
-        content_type = attachment.get('contentType', '')
+        filename = attachment.name
+        content_type = attachment.content_type
         
-        # Look for CID references in HTML
-        cid_pattern = r'cid:([^"\'>\s]+)'
-        cid_matches = re.findall(cid_pattern, html_content, re.IGNORECASE)
+        # CID references in HTML attributes, found when the HTML was scanned
+        cid_matches = document.cid_references
         
         # Check if this attachment matches any CID reference or is likely embedded
         for cid in cid_matches:
@@ -285,82 +644,125 @@ def is_embedded_image(attachment, html_content):
         logger.warning(f"Error checking if attachment is embedded: {str(e)}")
         return False
 
-def resolve_cid_images_in_html(html_content, attachments):
-    """Replace CID references in HTML with base64 data URLs"""
-    try:
-        logger.info("Resolving CID image references in HTML...")
-        
-        # Find all CID references in the HTML
-        cid_pattern = r'src=["\']cid:([^"\']+)["\']'
-        cid_matches = re.findall(cid_pattern, html_content, re.IGNORECASE)
-        
-        resolved_count = 0
-        for cid in cid_matches:
-            logger.info(f"Attempting to resolve CID: {cid}")
-            
-            # Look for matching attachment
-            for attachment in attachments:
-                attachment_name = attachment.get('name', '')
-                content_type = attachment.get('contentType', '')
-                
+def cid_image_data_url(attachment):
+    """Build the data: URL for an attachment used as an inline CID image"""
+    # If content_type is not an image type, detect it from the magic bytes or the extension
+    content_type = image_mime_type(attachment.content_type, attachment.name, attachment.peek(SNIFF_BYTES))
+    
+    return f"data:{content_type};base64,{attachment.to_base64()}"
+
+class CidIndex:
+    """
+    Resolves CIDs to attachments. A CID resolves to the first attachment whose
+    name contains it or that is an image, so the candidates for any CID are
+    the image attachments plus the few non-image ones whose name contains it.
+    Results are memoized per CID, and the replacement built by `build` (a data
+    URL or an asset filename) once per attachment.
+    """
+    
+    def __init__(self, attachments, build):
+        self.attachments = [(attachment, attachment.is_image()) for attachment in attachments]
+        self.build = build
+        self.built = {}       # {attachment index: replacement, or None if unusable}
+        self.resolved = {}    # {cid: replacement or None}
+    
+    def _replacement(self, index, attachment, cid):
+        if index not in self.built:
+            try:
+                # Get the image data
+                self.built[index] = self.build(attachment) if attachment.has_content() else None
+            except Exception as e:
+                logger.warning(f"Error resolving CID {cid} with attachment {attachment.name}: {str(e)}")
+                self.built[index] = None
+        return self.built[index]
+    
+    def resolve(self, cid):
+        """Get the replacement for a CID, or None if no attachment matches"""
+        if cid not in self.resolved:
+            replacement = None
+            for index, (attachment, is_image) in enumerate(self.attachments):
                 # Check if this attachment matches the CID or is an image
-                if (cid in attachment_name or 
-                    content_type.startswith('image/') or
-                    attachment_name.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'))):
-                    
-                    try:
-                        # Get the image data
-                        image_data = attachment.get('content', '')
-                        if not image_data:
-                            continue
-                            
-                        # If content_type is not set, try to detect it
-                        if not content_type or not content_type.startswith('image/'):
-                            file_ext = Path(attachment_name).suffix.lower()
-                            content_type = {
-                                '.jpg': 'image/jpeg',
-                                '.jpeg': 'image/jpeg',
-                                '.png': 'image/png',
-                                '.gif': 'image/gif',
-                                '.bmp': 'image/bmp',
-                                '.webp': 'image/webp'
-                            }.get(file_ext, 'image/jpeg')
-                        
-                        # Create data URL
-                        data_url = f"data:{content_type};base64,{image_data}"
-                        
-                        # Replace the CID reference with the data URL
-                        old_src = f'src="cid:{cid}"'
-                        new_src = f'src="{data_url}"'
-                        html_content = html_content.replace(old_src, new_src)
-                        
-                        old_src_single = f"src='cid:{cid}'"
-                        new_src_single = f"src='{data_url}'"
-                        html_content = html_content.replace(old_src_single, new_src_single)
-                        
-                        logger.info(f"✓ Resolved CID {cid} to data URL using attachment {attachment_name}")
-                        resolved_count += 1
+                if is_image or cid in attachment.name:
+                    replacement = self._replacement(index, attachment, cid)
+                    if replacement:
+                        logger.info(f"✓ Resolved CID {cid} using attachment {attachment.name}")
                         break
-                        
-                    except Exception as e:
-                        logger.warning(f"Error resolving CID {cid} with attachment {attachment_name}: {str(e)}")
-        
-        logger.info(f"Resolved {resolved_count} out of {len(cid_matches)} CID references")
-        return html_content
-        
+            self.resolved[cid] = replacement
+        return self.resolved[cid]
+
+def rewrite_cid_references(document, index):
+    """Rewrite every src="cid:..." reference the index resolves, in a single pass"""
+    logger.info("Resolving CID image references in HTML...")
+    
+    # CID references in src attributes, found when the HTML was scanned
+    cid_sources = [source for source in document.sources if source.attribute == 'src' and source.cid is not None]
+    
+    replacements = {}
+    for source in cid_sources:
+        replacement = index.resolve(source.cid)
+        if replacement:
+            replacements[source] = replacement
+    
+    logger.info(f"Resolved {len(replacements)} out of {len(cid_sources)} CID references")
+    return document.replace(replacements)
+
+def resolve_cid_images_in_html(document, attachments):
+    """Replace CID references in a scanned HTML document with base64 data URLs"""
+    try:
+        return rewrite_cid_references(document, CidIndex(attachments, cid_image_data_url))
     except Exception as e:
         logger.error(f"Error resolving CID images: {str(e)}")
-        return html_content
+        return document
+
+def resolve_cid_images_as_assets(document, attachments):
+    """
+    Replace CID references in a scanned HTML document with relative filenames of inline
+    image assets, which are uploaded to Gotenberg next to index.html instead of inlined as base64.
+    
+    Returns:
+        tuple: (document, inline_assets as a list of (filename, EmailAttachment))
+    """
+    inline_assets = []
+    
+    def add_asset(attachment):
+        suffix = file_extension(attachment.name)
+        if not SAFE_EXTENSION_PATTERN.fullmatch(suffix):
+            suffix = ''
+        filename = f"inline_{len(inline_assets)}{suffix}"
+        inline_assets.append((filename, attachment))
+        return filename
+    
+    try:
+        return rewrite_cid_references(document, CidIndex(attachments, add_asset)), inline_assets
+    except Exception as e:
+        logger.error(f"Error resolving CID images: {str(e)}")
+        return document, []
+
+def inline_assets_to_data_urls(document, inline_assets):
+    """
+    Point the asset references of a scanned document back at data: URLs, for renderers that only
+    get the HTML (WeasyPrint). Returns the HTML.
+    """
+    if not inline_assets:
+        return document.html
+    data_urls = {filename: cid_image_data_url(attachment) for filename, attachment in inline_assets}
+    return document.replace({
+        source: data_urls[source.value] for source in document.sources if source.value in data_urls
+    }).html
+
+def email_html_cache_key(html_content, inline_assets=(), html_digest=None):
+    """
+    Cache key for an email body: the digest of the HTML (html_digest if the caller already
+    has it) plus the content digests of its inline assets
+    """
+    assets = ';'.join(f"{filename}={attachment.digest}" for filename, attachment in inline_assets)
+    return cache_key('chromium-html', EMAIL_TEMPLATE_VERSION, html_digest or content_digest(html_content), assets=assets)
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    try:
-        # Check if Gotenberg is available
-        response = requests.get(f"{GOTENBERG_URL}/health", timeout=3)  # Reduced timeout
-        gotenberg_status = response.status_code == 200
-    except:
-        gotenberg_status = False
+    # Check if Gotenberg is available
+    gotenberg_status = gotenberg.health()
     
     # Clean up expired PDFs while we're at it
     cleanup_old_pdfs()
@@ -378,79 +780,45 @@ def cache_status():
     stats = pdf_cache.get_stats()
     return jsonify({
         'cache': stats,
-        'temp_pdfs': len(temp_pdfs)
+        'merged_cache': merged_pdf_cache.get_stats(),
+        'result_cache': result_cache.get_stats(),
+        'cache_key_versions': {
+            'renderer': RENDERER_VERSION,
+            'email_html': EMAIL_TEMPLATE_VERSION,
+            'image': IMAGE_TEMPLATE_VERSION,
+            'libreoffice': LIBREOFFICE_VERSION
+        },
+        'gotenberg': gotenberg.get_stats(),
+        'async_gotenberg': async_gotenberg.get_stats() if async_gotenberg else None,
+        'in_flight': conversions_in_flight.get_stats(),
+        'temp_pdfs': sum(1 for _ in DOWNLOAD_DIR.glob('*.pdf'))
     })
 
 @app.route('/clear-cache', methods=['POST'])
 def clear_cache():
     """Clear PDF cache"""
     pdf_cache.clear()
+    merged_pdf_cache.clear()
+    result_cache.clear()
     return jsonify({
         'success': True,
         'message': 'PDF cache cleared'
     })
 
-def convert_html_to_pdf_with_gotenberg(html_content):
-    """Convert HTML to PDF using Gotenberg's Chromium route with print-optimized settings and caching"""
-    try:
-        # First, check if we have this exact HTML content in cache
-        cached_pdf = pdf_cache.get(html_content)
-        if cached_pdf:
-            logger.info(f"Using cached PDF conversion ({len(cached_pdf)} bytes)")
-            return cached_pdf
-        
-        logger.info(f"Converting HTML email to PDF using Gotenberg ({len(html_content)} characters)")
-        
-        # Enhance HTML content with print-specific CSS and settings
-        enhanced_html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <style>
-                @media print {{
-                    body {{ 
-                        font-family: Arial, sans-serif;
-                        font-size: 12pt;
-                        line-height: 1.6;
-                        color: #000;
-                        background: white;
-                        margin: 0;
-                        padding: 20px;
-                    }}
-                    .no-print {{ display: none !important; }}
-                    img {{ max-width: 100%; height: auto; }}
-                    table {{ 
-                        border-collapse: collapse; 
-                        width: 100%; 
-                        border: none !important;
-                        margin: 1em 0;
-                    }}
-                    th, td {{ 
-                        border: none !important; 
-                        padding: 12px 8px; 
-                        vertical-align: top;
-                    }}
-                    h1, h2, h3, h4, h5, h6 {{ 
-                        color: #000; 
-                        page-break-after: avoid;
-                        margin: 1.2em 0 0.8em 0;
-                        font-weight: bold;
-                    }}
-                    p {{ margin: 1em 0; }}
-                    blockquote {{ 
-                        margin: 1.5em 0; 
-                        padding-left: 1em; 
-                        border-left: none;
-                    }}
-                    /* Remove any default borders from email content */
-                    * {{ border: none !important; }}
-                    /* Preserve background colors but remove borders */
-                    [style*="border"] {{ border: none !important; }}
-                }}
-                
-                /* Apply same styles to screen for consistency */
+def build_email_html_request(html_content, inline_assets=()):
+    """
+    Build the Gotenberg Chromium form (files, data) for an email body with print settings.
+    Inline assets (filename, EmailAttachment) are uploaded next to index.html.
+    """
+    # Enhance HTML content with print-specific CSS and settings
+    enhanced_html = f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <style>
+            @media print {{
                 body {{ 
                     font-family: Arial, sans-serif;
                     font-size: 12pt;
@@ -459,8 +827,8 @@ def convert_html_to_pdf_with_gotenberg(html_content):
                     background: white;
                     margin: 0;
                     padding: 20px;
-                    max-width: 8.5in;
                 }}
+                .no-print {{ display: none !important; }}
                 img {{ max-width: 100%; height: auto; }}
                 table {{ 
                     border-collapse: collapse; 
@@ -475,6 +843,7 @@ def convert_html_to_pdf_with_gotenberg(html_content):
                 }}
                 h1, h2, h3, h4, h5, h6 {{ 
                     color: #000; 
+                    page-break-after: avoid;
                     margin: 1.2em 0 0.8em 0;
                     font-weight: bold;
                 }}
@@ -484,45 +853,112 @@ def convert_html_to_pdf_with_gotenberg(html_content):
                     padding-left: 1em; 
                     border-left: none;
                 }}
-                /* Remove any borders from email content */
+                /* Remove any default borders from email content */
                 * {{ border: none !important; }}
+                /* Preserve background colors but remove borders */
                 [style*="border"] {{ border: none !important; }}
-            </style>
-        </head>
-        <body>
-            {html_content}
-        </body>
-        </html>
-        """
+            }}
+
+            /* Apply same styles to screen for consistency */
+            body {{ 
+                font-family: Arial, sans-serif;
+                font-size: 12pt;
+                line-height: 1.6;
+                color: #000;
+                background: white;
+                margin: 0;
+                padding: 20px;
+                max-width: 8.5in;
+            }}
+            img {{ max-width: 100%; height: auto; }}
+            table {{ 
+                border-collapse: collapse; 
+                width: 100%; 
+                border: none !important;
+                margin: 1em 0;
+            }}
+            th, td {{ 
+                border: none !important; 
+                padding: 12px 8px; 
+                vertical-align: top;
+            }}
+            h1, h2, h3, h4, h5, h6 {{ 
+                color: #000; 
+                margin: 1.2em 0 0.8em 0;
+                font-weight: bold;
+            }}
+            p {{ margin: 1em 0; }}
+            blockquote {{ 
+                margin: 1.5em 0; 
+                padding-left: 1em; 
+                border-left: none;
+            }}
+            /* Remove any borders from email content */
+            * {{ border: none !important; }}
+            [style*="border"] {{ border: none !important; }}
+        </style>
+    </head>
+    <body>
+        {html_content}
+    </body>
+    </html>
+    """
+
+    # Prepare the HTML file for Gotenberg - must be named 'index.html'
+    files = [
+        ('files', ('index.html', enhanced_html, 'text/html'))
+    ]
+    for filename, attachment in inline_assets:
+        files.append(('files', (filename, attachment.read(), attachment.content_type or 'application/octet-stream')))
+
+    # Form data for print-like settings - optimized for speed
+    data = {
+        'paperWidth': '8.5',      # US Letter width in inches
+        'paperHeight': '11',      # US Letter height in inches
+        'marginTop': '0.5',       # Top margin in inches
+        'marginBottom': '0.5',    # Bottom margin in inches
+        'marginLeft': '0.5',      # Left margin in inches
+        'marginRight': '0.5',     # Right margin in inches
+        'printBackground': 'true', # Include background colors/images
+        'preferCSSPageSize': 'false', # Use our paper size settings
+        'emulateMediaType': 'print',  # Force print media type
+        'scale': 1.0,             # No scaling
+        'waitDelay': '100ms',     # Wait for 100ms after page load (reduced from default)
+        'waitForExpression': 'document.readyState === "complete"'  # Wait for page to be fully loaded
+    }
+    
+    return files, data
+
+# Version of the email template and print options, part of the email body cache keys
+EMAIL_TEMPLATE_VERSION = template_version(RENDERER_VERSION, build_email_html_request(''))
+
+# Version of the LibreOffice route (no options are sent), part of the attachment cache keys
+LIBREOFFICE_VERSION = template_version(RENDERER_VERSION, 'libreoffice')
+
+def convert_html_to_pdf_with_gotenberg(html_content, inline_assets=(), html_digest=None):
+    """Convert HTML to PDF using Gotenberg's Chromium route with print-optimized settings and caching"""
+    cache_key = email_html_cache_key(html_content, inline_assets, html_digest)
+    cache_hash = pdf_cache.key_for(cache_key)
+    # If the same HTML is already being converted, wait for that result instead
+    return conversions_in_flight.do(
+        cache_hash, _convert_html_to_pdf_with_gotenberg, html_content, inline_assets, cache_key, cache_hash
+    )
+
+def _convert_html_to_pdf_with_gotenberg(html_content, inline_assets, cache_key, cache_hash):
+    """HTML conversion for convert_html_to_pdf_with_gotenberg, run once per in-flight cache key"""
+    try:
+        # First, check if we have this exact HTML content in cache
+        cached_pdf = pdf_cache.get(cache_key, cache_hash)
+        if cached_pdf:
+            logger.info(f"Using cached PDF conversion ({len(cached_pdf)} bytes)")
+            return cached_pdf
         
-        # Prepare the HTML file for Gotenberg - must be named 'index.html'
-        files = {
-            'files': ('index.html', enhanced_html, 'text/html')
-        }
+        logger.info(f"Converting HTML email to PDF using Gotenberg ({len(html_content)} characters, {len(inline_assets)} inline images)")
         
-        # Form data for print-like settings - optimized for speed
-        data = {
-            'paperWidth': '8.5',      # US Letter width in inches
-            'paperHeight': '11',      # US Letter height in inches
-            'marginTop': '0.5',       # Top margin in inches
-            'marginBottom': '0.5',    # Bottom margin in inches
-            'marginLeft': '0.5',      # Left margin in inches
-            'marginRight': '0.5',     # Right margin in inches
-            'printBackground': 'true', # Include background colors/images
-            'preferCSSPageSize': 'false', # Use our paper size settings
-            'emulateMediaType': 'print',  # Force print media type
-            'scale': 1.0,             # No scaling
-            'waitDelay': '100ms',     # Wait for 100ms after page load (reduced from default)
-            'waitForExpression': 'document.readyState === "complete"'  # Wait for page to be fully loaded
-        }
+        files, data = build_email_html_request(html_content, inline_assets)
         
         # Send request to Gotenberg Chromium route for HTML conversion
-        response = requests.post(
-            f"{GOTENBERG_URL}/forms/chromium/convert/html",
-            files=files,
-            data=data,
-            timeout=30
-        )
+        response = gotenberg.post('chromium_html', files=files, data=data)
         
         if response.status_code == 200:
             pdf_content = response.content
@@ -530,7 +966,7 @@ def convert_html_to_pdf_with_gotenberg(html_content):
             logger.info(f"✓ Successfully converted HTML email to PDF with print settings ({pdf_size} bytes)")
             
             # Store in cache for future use
-            pdf_cache.put(html_content, pdf_content)
+            pdf_cache.put(cache_key, pdf_content, cache_hash)
             
             return pdf_content
         else:
@@ -566,62 +1002,147 @@ def convert_html_to_pdf_with_weasyprint(html_content):
         logger.error(f"✗ WeasyPrint conversion failed: {str(e)}")
         return None
 
-def convert_file_to_pdf_with_gotenberg(file_content, filename, content_type):
+def file_conversion_route(filename, head=None):
+    """
+    Pick how a file is converted from its signature (magic bytes), then its extension.
+    A misnamed file follows its actual format, and files whose bytes contradict their
+    extension (archives, executables, truncated files) are not sent anywhere.
+    
+    Args:
+        filename: The file name
+        head: The first SNIFF_BYTES of the file, or None to route on the extension alone
+    
+    Returns:
+        str: 'image', 'libreoffice', 'pdf' (already a PDF, used as is) or None if unsupported
+    """
+    # Determine the file extension
+    file_ext = file_extension(filename)
+    logger.info(f"File extension detected: {file_ext}")
+    
+    if head is None:
+        # Image file types are converted directly to PDF, the rest by LibreOffice if it supports them
+        if file_ext in IMAGE_EXTENSIONS:
+            return 'image'
+        if file_ext == '.pdf':
+            return 'pdf'
+        if file_ext in OFFICE_EXTENSIONS:
+            return 'libreoffice'
+        return None
+    
+    if not head:
+        return None
+    
+    magic_type = sniff_magic(head)
+    if magic_type == 'application/pdf':
+        return 'pdf'
+    if magic_type and magic_type.startswith('image/'):
+        return 'image'
+    if magic_type in OFFICE_CONTAINER_TYPES:
+        # zip/OLE containers are only office documents if the extension says so
+        return 'libreoffice' if file_ext in OFFICE_EXTENSIONS else None
+    if magic_type is None and file_ext == '.pdf':
+        # The header may follow some junk bytes, validation decides whether the file is usable
+        return 'pdf'
+    if magic_type is None and file_ext in OFFICE_EXTENSIONS and looks_like_text(head):
+        # Text formats (txt, csv, html, and HTML or RTF saved as .doc) have no signature
+        return 'libreoffice'
+    
+    logger.info(f"File {filename} doesn't match a supported format (signature: {magic_type or 'unknown'})")
+    return None
+
+def passthrough_pdf(file_content, filename):
+    """
+    Use a PDF attachment as is, without caching or converting it. Files that fail the
+    header/trailer check are repaired if REPAIR_PDF_ATTACHMENTS is on.
+    
+    Returns:
+        bytes: The PDF to merge, or None if it is damaged beyond repair or password protected
+    """
+    problem = pdf_problem(file_content)
+    if problem is None:
+        if pdf_is_locked(file_content):
+            logger.warning(f"✗ PDF attachment {filename} is password protected and can't be merged")
+            return None
+        logger.info(f"✓ {filename} is already a PDF, using it as is ({len(file_content)} bytes)")
+        return file_content
+    
+    logger.warning(f"PDF attachment {filename} failed validation: {problem}")
+    if not REPAIR_PDF_ATTACHMENTS:
+        return None
+    
+    repaired = repair_pdf(file_content)
+    if repaired:
+        logger.info(f"✓ Repaired PDF attachment {filename} ({len(repaired)} bytes)")
+    else:
+        logger.warning(f"✗ Could not repair PDF attachment {filename}")
+    return repaired
+
+def convert_file_to_pdf_with_gotenberg(file_content, filename, content_type, content_hash=None):
     """Convert any file to PDF using Gotenberg's LibreOffice route with caching"""
+    # Route on the file signature first, so unsupported files are never hashed or sent anywhere
+    route = file_conversion_route(filename, file_content[:SNIFF_BYTES])
+    if route is None:
+        logger.warning(f"File type {file_extension(filename)} not supported for conversion")
+        return None
+    if route == 'pdf':
+        return passthrough_pdf(file_content, filename)
+    if route == 'image':
+        logger.info(f"Image file {file_extension(filename)} detected - converting directly to PDF using image conversion")
+        # Image attachments are cached under their image key by the image converter
+        return convert_image_to_pdf_with_gotenberg(file_content, filename, content_type, content_hash)
+    
+    # content_hash: content_digest of file_content if the caller already has it (EmailAttachment.digest)
+    file_key = libreoffice_cache_key(file_content, filename, content_hash)
+    cache_hash = pdf_cache.key_for(file_key)
+    # If the same file is already being converted, wait for that result instead
+    return conversions_in_flight.do(
+        cache_hash, _convert_file_to_pdf_with_gotenberg, file_content, filename, content_type, file_key, cache_hash
+    )
+
+def libreoffice_cache_key(file_content, filename, content_hash=None):
+    """
+    Cache key for a LibreOffice conversion: the digest of the file and its extension,
+    which selects the import filter (the same bytes as .csv and .txt render differently)
+    """
+    digest = content_hash or content_digest(file_content)
+    return cache_key('libreoffice', LIBREOFFICE_VERSION, digest, ext=file_extension(filename))
+
+def image_pdf_cache_hash(image_data, filename, mime_type, content_hash=None):
+    """PDF cache key of an image page, or None with LOCAL_IMAGE_PDF (local conversions aren't cached)"""
+    if LOCAL_IMAGE_PDF:
+        return None
+    return pdf_cache.key_for(image_cache_key(image_data, mime_type, content_hash))
+
+def converted_file_cache_hash(route, file_content, filename, content_type, content_hash=None):
+    """PDF cache key the converter for a file conversion route caches its PDF under, or None"""
+    if route == 'image':
+        return image_pdf_cache_hash(file_content, filename, content_type, content_hash)
+    return pdf_cache.key_for(libreoffice_cache_key(file_content, filename, content_hash))
+
+def _convert_file_to_pdf_with_gotenberg(file_content, filename, content_type, file_key, cache_hash):
+    """File conversion for convert_file_to_pdf_with_gotenberg, run once per in-flight cache key"""
     try:
         logger.info(f"Starting conversion of {filename} ({len(file_content)} bytes, type: {content_type})")
         
-        # Check cache first using the file content as key
-        cached_pdf = pdf_cache.get(file_content)
+        # Check cache first
+        cached_pdf = pdf_cache.get(file_key, cache_hash)
         if cached_pdf:
             logger.info(f"Using cached PDF conversion for {filename} ({len(cached_pdf)} bytes)")
             return cached_pdf
         
-        # Determine the file extension
-        file_ext = Path(filename).suffix.lower()
-        logger.info(f"File extension detected: {file_ext}")
-        
-        # Supported file types that LibreOffice can convert
-        supported_extensions = {
-            '.docx', '.doc', '.odt', '.rtf',  # Word documents
-            '.xlsx', '.xls', '.ods',          # Excel spreadsheets
-            '.pptx', '.ppt', '.odp',          # PowerPoint presentations
-            '.txt', '.csv',                   # Text files
-            '.html', '.htm'                   # HTML files
-        }
-        
-        # Image file types that we can convert directly to PDF
-        image_extensions = {
-            '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'
-        }
-        
-        if file_ext in image_extensions:
-            logger.info(f"Image file {file_ext} detected - converting directly to PDF using image conversion")
-            # Use our image-to-PDF conversion for image files
-            pdf_content = convert_image_to_pdf_with_gotenberg(file_content, filename, content_type)
-            if pdf_content:
-                # We don't need to cache here as the image converter already does caching
-                return pdf_content
-            return None
-        elif file_ext not in supported_extensions:
-            logger.warning(f"File type {file_ext} not supported for conversion")
-            return None
+        file_ext = file_extension(filename)
         
         logger.info(f"File type {file_ext} is supported, proceeding with Gotenberg conversion...")
         
-        # Prepare the request to Gotenberg
+        # Prepare the request to Gotenberg, with the content type sniffed from the file itself
         files = {
-            'files': (filename, file_content, content_type)
+            'files': (filename, file_content, sniff_content_type(file_content[:SNIFF_BYTES], filename, content_type))
         }
         
         logger.info(f"Sending {filename} to Gotenberg at {GOTENBERG_URL}/forms/libreoffice/convert")
         
-        # Send request to Gotenberg LibreOffice route with optimized timeout
-        response = requests.post(
-            f"{GOTENBERG_URL}/forms/libreoffice/convert",
-            files=files,
-            timeout=25  # Slightly reduced timeout
-        )
+        # Send request to Gotenberg LibreOffice route
+        response = gotenberg.post('libreoffice', files=files)
         
         logger.info(f"Gotenberg response for {filename}: Status {response.status_code}")
         
@@ -631,7 +1152,7 @@ def convert_file_to_pdf_with_gotenberg(file_content, filename, content_type):
             logger.info(f"✓ Successfully converted {filename} to PDF ({pdf_size} bytes)")
             
             # Cache the result for future use
-            pdf_cache.put(file_content, pdf_content)
+            pdf_cache.put(file_key, pdf_content, cache_hash)
             
             return pdf_content
         else:
@@ -644,27 +1165,33 @@ def convert_file_to_pdf_with_gotenberg(file_content, filename, content_type):
         logger.error(f"✗ Exception during conversion of {filename}: {str(e)}")
         return None
 
-def merge_pdfs_with_gotenberg(pdf_files):
-    """Merge multiple PDFs using Gotenberg's merge endpoint"""
+def build_merge_request(pdf_files):
+    """Build the Gotenberg merge form files, named so Gotenberg keeps their order"""
+    # Prepare files for Gotenberg merge endpoint
+    files = {}
+    for i, pdf_file in enumerate(pdf_files):
+        files[f'file{i}.pdf'] = (f'file{i}.pdf', pdf_file['content'], 'application/pdf')
+    return files
+
+def merge_pdfs_with_gotenberg(pdf_files, output_path=None):
+    """Merge multiple PDFs using Gotenberg's merge endpoint, streamed into output_path if given"""
     try:
         if len(pdf_files) == 1:
             return pdf_files[0]['content']
         
-        # Prepare files for Gotenberg merge endpoint
-        files = {}
-        for i, pdf_file in enumerate(pdf_files):
-            files[f'file{i}.pdf'] = (f'file{i}.pdf', pdf_file['content'], 'application/pdf')
+        files = build_merge_request(pdf_files)
         
         # Send request to Gotenberg merge endpoint
-        response = requests.post(
-            f"{GOTENBERG_URL}/forms/pdfengines/merge",
-            files=files,
-            timeout=30
-        )
+        response = gotenberg.post('merge', files=files, stream=output_path is not None)
         
         if response.status_code == 200:
             logger.info(f"Successfully merged {len(pdf_files)} PDFs")
-            return response.content
+            if output_path is None:
+                return response.content
+            with open(output_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+            return output_path
         else:
             logger.error(f"Gotenberg merge failed: {response.status_code} - {response.text}")
             return None
@@ -673,24 +1200,15 @@ def merge_pdfs_with_gotenberg(pdf_files):
         logger.error(f"Error merging PDFs: {str(e)}")
         return None
 
-def fallback_merge_pdfs(pdf_files):
-    """Fallback PDF merge using PyPDF2"""
-    try:
-        merger = PdfMerger()
-        
-        for pdf_file in pdf_files:
-            pdf_stream = io.BytesIO(pdf_file['content'])
-            merger.append(pdf_stream)
-        
-        output_stream = io.BytesIO()
-        merger.write(output_stream)
-        merger.close()
-        
-        return output_stream.getvalue()
-        
-    except Exception as e:
-        logger.error(f"Fallback PDF merge failed: {str(e)}")
-        return None
+def merge_pdfs_locally(pdf_files, output_path, merge_engine=None):
+    """
+    Merge PDFs in-process into output_path, sharing identical fonts and images.
+    merge_engine may already hold the first PDFs, appended while the rest were converting.
+    """
+    merge_engine = merge_engine or PdfMergeEngine()
+    if merge_engine.append_pending(pdf_files) and merge_engine.write(output_path):
+        return output_path
+    return None
 
 @app.route('/convert', methods=['POST'])
 def convert():
@@ -730,279 +1248,893 @@ def convert():
         logger.error(f"✗ Conversion failed: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/convert-with-attachments', methods=['POST'])
-def convert_with_attachments():
-    """Convert HTML email to PDF and include converted attachments"""
+def process_attachment(attachment, document, mode):
+    """Convert a single email attachment to PDF, returns a result dict or None if skipped"""
     try:
-        data = request.get_json()
-        html_content = data.get('html', '')
-        attachments = data.get('attachments', [])
-        mode = data.get('mode', 'full')  # 'full' or 'individual'
-        extract_images = data.get('extractImages', False)  # Whether to extract embedded images
+        filename = attachment.name
+        content_type = attachment.content_type
         
-        if not html_content:
-            return jsonify({'error': 'No HTML content provided'}), 400
+        # In full mode, skip embedded images (they're already in the email content)
+        if mode == 'full' and is_embedded_image(attachment, document):
+            logger.info(f"Skipping embedded image {filename} in full mode (already in email content)")
+            return None
         
-        # Resolve CID image references in the HTML before converting to PDF
-        if attachments:
-            html_content = resolve_cid_images_in_html(html_content, attachments)
+        # Route on the file signature before decoding it all, unsupported files stop here
+        route = file_conversion_route(filename, attachment.peek(SNIFF_BYTES))
+        if route is None:
+            return unsupported_attachment_result(filename)
         
-        # Convert main email HTML to PDF using Gotenberg (with WeasyPrint fallback)
-        logger.info("Converting email HTML to PDF...")
-        email_pdf_content = convert_html_to_pdf_with_gotenberg(html_content)
+        # Decode base64 content (or read the uploaded file), decoded once and shared with dedup
+        file_content = attachment.read()
         
-        if email_pdf_content is None:
-            logger.warning("Gotenberg failed for email HTML, trying WeasyPrint fallback")
-            email_pdf_content = convert_html_to_pdf_with_weasyprint(html_content)
+        logger.info(f"Processing attachment: {filename} ({content_type}, {len(file_content)} bytes)")
         
-        if email_pdf_content is None:
-            raise Exception("Failed to convert email HTML to PDF with both methods")
+        if route == 'pdf':
+            # PDF attachments are merged as they are: no cache entry, no Gotenberg call
+            pdf_content = passthrough_pdf(file_content, filename)
+            attachment.release()
+            return attachment_result(filename, pdf_content, passthrough=True)
         
-        logger.info(f"✓ Email HTML converted to PDF ({len(email_pdf_content)} bytes)")
-        
-        # Prepare list of PDFs to merge (starting with email PDF)
-        pdfs_to_merge = [{
-            'name': 'email.pdf',
-            'content': email_pdf_content
-        }]
+        # Try to convert the file to PDF using Gotenberg
+        pdf_content = convert_file_to_pdf_with_gotenberg(file_content, filename, content_type, attachment.digest)
+        cache_hash = converted_file_cache_hash(route, file_content, filename, content_type, attachment.digest)
+        attachment.release()
         
-        # Define a function to process a single attachment
-        def process_attachment(attachment):
+        return attachment_result(filename, pdf_content, cache_hash=cache_hash)
+            
+    except Exception as e:
+        logger.error(f"Error processing attachment {attachment.name}: {str(e)}")
+        return {
+            'success': False,
+            'name': attachment.name,
+            'reason': f'Processing error: {str(e)}'
+        }
+
+def attachment_result(filename, pdf_content, passthrough=False, cache_hash=None):
+    """
+    Build the result dict for a converted (or failed) attachment, passthrough for PDF attachments
+    used as is. cache_hash is the key the converter cached the PDF under, if it did.
+    """
+    if pdf_content:
+        if passthrough:
+            converted_pdf_name = f"{Path(filename).stem}.pdf"
+            logger.info(f"✓ Added PDF attachment {filename} without conversion ({len(pdf_content)} bytes)")
+        else:
+            converted_pdf_name = f"{Path(filename).stem}_converted.pdf"
+            logger.info(f"✓ Successfully converted {filename} to PDF ({len(pdf_content)} bytes)")
+        return {
+            'success': True,
+            'name': filename,
+            'pdf_name': converted_pdf_name,
+            'content': pdf_content,
+            'size': len(pdf_content),
+            'passthrough': passthrough,
+            'cache_hash': cache_hash
+        }
+    elif passthrough:
+        logger.warning(f"✗ Could not use PDF attachment {filename} - invalid PDF")
+        return {
+            'success': False,
+            'name': filename,
+            'reason': 'Invalid or damaged PDF'
+        }
+    else:
+        logger.warning(f"✗ Could not convert {filename} - conversion failed")
+        return {
+            'success': False,
+            'name': filename,
+            'reason': 'Conversion failed - unsupported file type or processing error'
+        }
+
+def unsupported_attachment_result(filename):
+    """Build the result dict for an attachment skipped because of its file type"""
+    logger.warning(f"✗ Skipping {filename} - unsupported file type")
+    return {
+        'success': False,
+        'name': filename,
+        'reason': 'Unsupported file type'
+    }
+
+def add_attachment_result(result, pdfs_to_merge, converted_attachments):
+    """Record an attachment result for merging and in the attachment summary"""
+    if result:
+        if result['success']:
+            pdfs_to_merge.append({
+                'name': result['pdf_name'],
+                'content': result['content'],
+                'passthrough': result['passthrough'],
+                'cache_hash': result['cache_hash']
+            })
+            converted_attachments.append({
+                'name': result['name'],
+                'converted': True,
+                'size': result['size'],
+                'passthrough': result['passthrough']
+            })
+        else:
+            converted_attachments.append({
+                'name': result['name'],
+                'converted': False,
+                'reason': result.get('reason', 'Unknown error')
+            })
+
+def select_extracted_images(document, attachments):
+    """Extract embedded images from the HTML document, skipping duplicates of image attachments"""
+    logger.info("Image extraction requested - scanning HTML for embedded images...")
+    extracted_images = extract_images_from_html(document)
+    
+    # Keep track of which images we've already processed as attachments to avoid duplicates
+    processed_attachment_hashes = set()
+    for attachment in attachments:
+        if attachment.is_image():
             try:
-                filename = attachment['name']
-                content_type = attachment.get('contentType', 'application/octet-stream')
-                
-                # In full mode, skip embedded images (they're already in the email content)
-                if mode == 'full' and is_embedded_image(attachment, html_content):
-                    logger.info(f"Skipping embedded image {filename} in full mode (already in email content)")
-                    return None
-                
-                # Decode base64 content
-                file_content = base64.b64decode(attachment['content'])
-                
-                logger.info(f"Processing attachment: {filename} ({content_type}, {len(file_content)} bytes)")
-                
-                # Try to convert the file to PDF using Gotenberg
-                pdf_content = convert_file_to_pdf_with_gotenberg(file_content, filename, content_type)
+                # Use the attachment's content hash (computed once per request) to detect duplicates
+                content_hash = attachment.digest
+                processed_attachment_hashes.add(content_hash)
+                logger.info(f"Added attachment {attachment.name} to processed list (hash: {content_hash[:8]}...)")
+            except:
+                pass
+    
+    # Filter out extracted images that are duplicates of attachments
+    filtered_images = []
+    for image_info in extracted_images:
+        try:
+            image_hash = image_info['digest'] = content_digest(image_info['data'])
+            
+            if image_hash in processed_attachment_hashes:
+                logger.info(f"Skipping duplicate image {image_info['filename']} - already processed as attachment (hash: {image_hash[:8]}...)")
+                continue
+            else:
+                logger.info(f"Image {image_info['filename']} is unique, will process (hash: {image_hash[:8]}...)")
+                filtered_images.append(image_info)
                 
-                if pdf_content:
-                    converted_pdf_name = f"{Path(filename).stem}_converted.pdf"
-                    logger.info(f"✓ Successfully converted {filename} to PDF ({len(pdf_content)} bytes)")
-                    return {
-                        'success': True,
-                        'name': filename,
-                        'pdf_name': converted_pdf_name,
-                        'content': pdf_content,
-                        'size': len(pdf_content)
-                    }
-                else:
-                    logger.warning(f"✗ Could not convert {filename} - conversion failed")
-                    return {
-                        'success': False,
-                        'name': filename,
-                        'reason': 'Conversion failed - unsupported file type or processing error'
-                    }
-                    
-            except Exception as e:
-                logger.error(f"Error processing attachment {attachment.get('name', 'unknown')}: {str(e)}")
-                return {
-                    'success': False,
-                    'name': attachment.get('name', 'unknown'),
-                    'reason': f'Processing error: {str(e)}'
-                }
+        except Exception as e:
+            logger.warning(f"Error checking image hash for {image_info['filename']}: {str(e)}")
+            # If we can't hash it, include it to be safe
+            filtered_images.append(image_info)
+    
+    logger.info(f"After deduplication: processing {len(filtered_images)} unique images out of {len(extracted_images)} extracted")
+    return filtered_images
+
+def image_conversion_args(image_info):
+    """(image_data, filename, mime_type, content_hash) of an extracted image, reusing its digest from deduplication"""
+    return image_info['data'], image_info['filename'], image_info['mime_type'], image_info.get('digest')
+
+def add_image_result(image_info, image_pdf_content, pdfs_to_merge, image_pdfs):
+    """Record an extracted image conversion result for merging and in the image summary"""
+    if image_pdf_content:
+        # Use a cleaner name for the PDF
+        base_name = Path(image_info['filename']).stem
+        image_pdf_name = f"{base_name}.pdf"
+        pdfs_to_merge.append({
+            'name': image_pdf_name,
+            'content': image_pdf_content,
+            'cache_hash': image_pdf_cache_hash(*image_conversion_args(image_info))
+        })
+        image_pdfs.append({
+            'name': image_info['filename'],
+            'pdf_name': image_pdf_name,
+            'converted': True,
+            'size': len(image_pdf_content),
+            'is_cid': image_info.get('is_cid', False)
+        })
+        logger.info(f"✓ Successfully converted image {image_info['filename']} to PDF")
+    else:
+        logger.warning(f"✗ Failed to convert image {image_info['filename']} to PDF")
+        image_pdfs.append({
+            'name': image_info['filename'],
+            'converted': False,
+            'reason': 'Image to PDF conversion failed'
+        })
+
+def convert_email_body(document, inline_assets=()):
+    """Convert the email HTML (a scanned HtmlDocument) to PDF using Gotenberg with WeasyPrint fallback"""
+    logger.info("Converting email HTML to PDF...")
+    email_pdf_content = convert_html_to_pdf_with_gotenberg(document.html, inline_assets, document.digest)
+    
+    if email_pdf_content is None:
+        logger.warning("Gotenberg failed for email HTML, trying WeasyPrint fallback")
+        email_pdf_content = convert_html_to_pdf_with_weasyprint(inline_assets_to_data_urls(document, inline_assets))
+    
+    if email_pdf_content is None:
+        raise Exception("Failed to convert email HTML to PDF with both methods")
+    
+    logger.info(f"✓ Email HTML converted to PDF ({len(email_pdf_content)} bytes)")
+    return email_pdf_content
+
+def run_conversion_pipeline(document, attachments, mode, extract_images, inline_assets=(), merge_engine=None):
+    """
+    Convert the email body (a scanned HtmlDocument), its attachments and (optionally)
+    its embedded images to PDFs.
+    inline_assets are the CID images uploaded next to the email HTML (see resolve_cid_images_as_assets).
+    With a merge_engine, the PDFs that are ready are appended to it in merge order
+    while waiting for later conversions. When no conversion takes longer than
+    MERGE_WAIT (e.g. all came from the cache), nothing is appended, so the caller
+    can still find the merged PDF in the merged-PDF cache before merging.
+    
+    Returns:
+        tuple: (email_pdf_content, pdfs_to_merge, converted_attachments, image_pdfs)
+    """
+    filtered_images = select_extracted_images(document, attachments) if extract_images else []
+    
+    # Process attachments and extracted images in parallel using thread pool
+    logger.info(f"Processing {len(attachments)} attachments and {len(filtered_images)} images in parallel")
+    converted_attachments = []
+    
+    # Submit all conversion tasks before rendering the body, so they overlap with it
+    images = [image_conversion_args(image_info) for image_info in filtered_images]
+    batch_images = BATCH_IMAGES and len(images) > 1
+    if batch_images:
+        image_calls = [(convert_images_to_pdf_batch, (images,))]
+    else:
+        image_calls = [(convert_image_to_pdf_with_gotenberg, image) for image in images]
+    futures = submit_bounded(
+        [(process_attachment, (attachment, document, mode)) for attachment in attachments] + image_calls
+    )
+    attachment_futures, image_futures = futures[:len(attachments)], futures[len(attachments):]
+    
+    # Convert main email HTML to PDF on this thread (Gotenberg with WeasyPrint fallback)
+    try:
+        email_pdf_content = convert_email_body(document, inline_assets)
+    except Exception:
+        for future in futures:
+            future.cancel()
+        raise
+    
+    # Prepare list of PDFs to merge (starting with email PDF)
+    pdfs_to_merge = [{
+        'name': 'email.pdf',
+        'content': email_pdf_content,
+        'cache_hash': pdf_cache.key_for(email_html_cache_key(document.html, inline_assets, document.digest))
+    }]
+    
+    def append_while_waiting(future):
+        # Merge what is ready only if the next result would otherwise be waited for
+        if merge_engine:
+            concurrent.futures.wait([future], timeout=MERGE_WAIT)
+            if not future.done():
+                merge_engine.append_pending(pdfs_to_merge)
+    
+    # Collect results in the original attachment order
+    for future in attachment_futures:
+        append_while_waiting(future)
+        add_attachment_result(future.result(), pdfs_to_merge, converted_attachments)
+    
+    if batch_images:
+        # A single future holds the PDFs of the whole batch, the images it couldn't
+        # render are converted one by one, concurrently like the other conversions
+        append_while_waiting(image_futures[0])
+        image_futures = image_batch_futures(image_futures[0], images)
+    
+    # Collect extracted image results in document order
+    image_pdfs = []
+    for i, image_info in enumerate(filtered_images):
+        try:
+            append_while_waiting(image_futures[i])
+            image_pdf_content = image_futures[i].result()
+            add_image_result(image_info, image_pdf_content, pdfs_to_merge, image_pdfs)
+        except Exception as e:
+            logger.error(f"Error converting image {image_info['filename']}: {str(e)}")
+            image_pdfs.append({
+                'name': image_info['filename'],
+                'converted': False,
+                'reason': f'Processing error: {str(e)}'
+            })
+    
+    if extract_images:
+        logger.info(f"Image extraction complete. Converted {len([p for p in image_pdfs if p['converted']])} out of {len(filtered_images)} unique images to PDF")
+    
+    return email_pdf_content, pdfs_to_merge, converted_attachments, image_pdfs
+
+def write_pdf_file(output_path, pdf_content):
+    with open(output_path, 'wb') as f:
+        f.write(pdf_content)
+
+def merge_pdfs(pdfs_to_merge, output_path, merge_engine=None):
+    """
+    Merge the converted PDFs into output_path: locally first, then with Gotenberg
+    (the other way around with MERGE_ENGINE=gotenberg), then the email PDF alone.
+    
+    Returns:
+        bool: True if output_path holds all the PDFs, False if only the email PDF
+    """
+    if len(pdfs_to_merge) == 1:
+        write_pdf_file(output_path, pdfs_to_merge[0]['content'])
+        return True
+    
+    logger.info(f"Merging {len(pdfs_to_merge)} PDFs...")
+    
+    if MERGE_ENGINE == 'gotenberg':
+        merged = merge_pdfs_with_gotenberg(pdfs_to_merge, output_path)
+        if not merged:
+            logger.info("Gotenberg merge failed, trying local merge...")
+            merged = merge_pdfs_locally(pdfs_to_merge, output_path)
+    else:
+        merged = merge_pdfs_locally(pdfs_to_merge, output_path, merge_engine)
+        if not merged:
+            logger.info("Local merge failed, trying Gotenberg merge...")
+            merged = merge_pdfs_with_gotenberg(pdfs_to_merge, output_path)
+    
+    if not merged:
+        logger.error("Both merge methods failed, returning email PDF only")
+        write_pdf_file(output_path, pdfs_to_merge[0]['content'])
+        return False
+    return True
+
+def merged_cache_key(pdfs_to_merge, mode):
+    """
+    Cache key for a merged PDF: the digests of its component PDFs in merge order,
+    plus the mode and merge engine, so the same parts are only merged once.
+    """
+    digests = ','.join(content_digest(pdf_file['content']) for pdf_file in pdfs_to_merge)
+    return merged_pdf_cache.key_for(cache_key('merged', MERGE_ENGINE, content_digest(digests), mode=mode))
+
+def cache_merged_pdf(cache_hash, output_path):
+    """
+    Add a merged PDF file to the merged-PDF cache, unless it is too large to be admitted.
+    
+    Returns:
+        bool: True if cached
+    """
+    try:
+        if os.path.getsize(output_path) > merged_pdf_cache.max_entry_bytes:
+            return False
+        # Copied by path, a large merged PDF is never loaded into memory
+        merged_pdf_cache.put_file(output_path, cache_hash)
+        return True
+    except OSError as e:
+        logger.warning(f"Could not cache merged PDF: {str(e)}")
+        return False
+
+def request_fingerprint(html_digest, attachments, mode, extract_images):
+    """
+    Fingerprint of a /convert-with-attachments request: the HTML digest, the name, content type
+    and content (as received) of every attachment, the mode and extractImages, versioned
+    with every template and setting that changes the output.
+    """
+    version = template_version(
+        EMAIL_TEMPLATE_VERSION, IMAGE_TEMPLATE_VERSION, LIBREOFFICE_VERSION,
+        INLINE_IMAGE_ASSETS, LOCAL_IMAGE_PDF, REPAIR_PDF_ATTACHMENTS, MERGE_ENGINE
+    )
+    parts = [html_digest]
+    parts.extend(f"{attachment.name}\0{attachment.content_type}\0{attachment.source_digest}" for attachment in attachments)
+    return result_cache.key_for(cache_key(
+        'request', version, content_digest('\n'.join(parts)), mode=mode, extract_images=bool(extract_images)
+    ))
+
+def conversion_is_complete(converted_attachments, image_pdfs):
+    """Check that nothing failed for a reason that may not happen again, so the result can be reused"""
+    repeatable_reasons = ('Unsupported file type', 'Invalid or damaged PDF')
+    return (all(item['converted'] or item.get('reason') in repeatable_reasons for item in converted_attachments) and
+            all(item['converted'] for item in image_pdfs))
+
+def cache_conversion_result(fingerprint, pdfs_to_merge, merged_hash=None):
+    """
+    Record a request result in the result cache: the merged PDF's key in the merged-PDF
+    cache, or the keys the converters cached the individual PDFs under in the PDF cache.
+    Records only point at cached PDFs, so a record is stale as soon as one of them is evicted.
+    """
+    if merged_hash:
+        record = {'merged': merged_hash}
+    else:
+        # PDF attachments used as is and locally converted images have no PDF cache entry,
+        # results with any of them aren't recorded
+        if not all(pdf_file.get('cache_hash') for pdf_file in pdfs_to_merge):
+            return
+        record = {'pdfs': [{'name': pdf_file['name'], 'key': pdf_file['cache_hash']} for pdf_file in pdfs_to_merge]}
+    result_cache.put(None, json.dumps(record).encode('utf-8'), fingerprint)
+
+def cached_conversion_result(fingerprint):
+    """
+    Get a recorded request result.
+    
+    Returns:
+        tuple: (path of a copy of the merged PDF or None, list of PDF dicts {name, content} or None),
+               or None if there is no record or a PDF it points at is no longer cached
+    """
+    record = result_cache.get(None, fingerprint)
+    if record is None:
+        return None
+    try:
+        record = json.loads(record)
+    except ValueError:
+        return None
+    
+    if record.get('merged'):
+        merged_path = cached_merged_pdf_file(record['merged'])
+        return (merged_path, None) if merged_path is not None else None
+    
+    pdf_files = []
+    for part in record.get('pdfs', []):
+        content = pdf_cache.get(None, part['key'])
+        if content is None:
+            return None
+        pdf_files.append({'name': part['name'], 'content': content})
+    return (None, pdf_files) if pdf_files else None
+
+def individual_pdfs_response(pdf_files):
+    """Store the email PDF and each attachment PDF for download and return their download info"""
+    pdf_downloads = []
+    for i, pdf_file in enumerate(pdf_files):
+        pdf_id = generate_pdf_id('email' if i == 0 else f"attachment_{i}")
+        store_temp_pdf(pdf_id, pdf_file['content'], pdf_file['name'])
+        pdf_downloads.append({
+            'id': pdf_id,
+            'filename': pdf_file['name'],
+            'size': len(pdf_file['content']),
+            'passthrough': pdf_file.get('passthrough', False),
+            'download_url': f'/download-pdf/{pdf_id}'
+        })
+    
+    # Return JSON with download information
+    return jsonify({
+        'mode': 'individual',
+        'pdfs': pdf_downloads,
+        'total_count': len(pdf_downloads),
+        'message': 'Individual PDFs prepared for download'
+    })
+
+def cached_merged_pdf_file(cache_hash):
+    """
+    Copy a merged PDF from the merged-PDF cache to a new file in the download directory,
+    by path with the file cache, so it is never loaded into memory.
+    
+    Returns:
+        str: Path of the copy, or None if the PDF is not cached
+    """
+    fd, merged_path = tempfile.mkstemp(prefix='merged_', suffix='.pdf', dir=DOWNLOAD_DIR)
+    os.close(fd)
+    try:
+        if merged_pdf_cache.get_file(cache_hash, merged_path):
+            return merged_path
+    except Exception:
+        os.unlink(merged_path)
+        raise
+    os.unlink(merged_path)
+    return None
+
+def merged_pdf_response(pdf_content):
+    """Send an already merged PDF the same way as a freshly merged one"""
+    fd, merged_path = tempfile.mkstemp(prefix='merged_', suffix='.pdf', dir=DOWNLOAD_DIR)
+    os.close(fd)
+    try:
+        write_pdf_file(merged_path, pdf_content)
+    except Exception:
+        os.unlink(merged_path)
+        raise
+    return send_merged_pdf(merged_path, 'email_with_attachments.pdf')
+
+def send_merged_pdf(output_path, download_name):
+    """Send a merged PDF file (with range support) and delete it"""
+    try:
+        return send_file(
+            output_path,
+            as_attachment=True,
+            download_name=download_name,
+            mimetype='application/pdf',
+            conditional=True
+        )
+    finally:
+        # send_file has opened the file, the open handle keeps it readable until the response is sent
+        os.unlink(output_path)
+
+async def cache_call(fn, *args):
+    """Call a PdfCache method from the event loop, off-loop when it touches disk"""
+    if CACHE_DIR:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+async def convert_with_gotenberg_async(route, build_request, cache_key, cache_hash, description):
+    """
+    Cached Gotenberg conversion on the async client, run once per in-flight cache key.
+    build_request() returns the (files, data) form; it is only called, in a worker thread,
+    after a cache miss, so cache hits and coalesced callers never encode the content.
+    """
+    try:
+        cached_pdf = await cache_call(pdf_cache.get, cache_key, cache_hash)
+        if cached_pdf:
+            logger.info(f"Using cached PDF for {description} ({len(cached_pdf)} bytes)")
+            return cached_pdf
         
-        # Process attachments in parallel using thread pool
-        logger.info(f"Processing {len(attachments)} attachments in parallel")
-        attachment_futures = []
-        converted_attachments = []
+        files, data = await asyncio.to_thread(build_request)
+        response = await async_gotenberg.post(route, files=files, data=data)
         
-        # Submit all attachment conversion tasks
-        for attachment in attachments:
-            attachment_futures.append(thread_pool.submit(process_attachment, attachment))
+        if response.status_code == 200:
+            pdf_content = response.content
+            logger.info(f"✓ Successfully converted {description} to PDF ({len(pdf_content)} bytes)")
+            await cache_call(pdf_cache.put, cache_key, pdf_content, cache_hash)
+            return pdf_content
+        else:
+            logger.error(f"✗ Gotenberg conversion failed for {description}: {response.status_code}")
+            logger.error(f"Response text: {response.text[:500]}")
+            return None
+            
+    except Exception as e:
+        logger.error(f"✗ Exception converting {description} to PDF: {str(e)}")
+        return None
+
+async def convert_html_to_pdf_async(html_content, inline_assets=(), html_digest=None):
+    """Async counterpart of convert_html_to_pdf_with_gotenberg, hashing runs in a worker thread"""
+    cache_key = await asyncio.to_thread(email_html_cache_key, html_content, inline_assets, html_digest)
+    cache_hash = pdf_cache.key_for(cache_key)
+    return await conversions_in_flight.do_async(
+        cache_hash, convert_with_gotenberg_async, 'chromium_html',
+        lambda: build_email_html_request(html_content, inline_assets), cache_key, cache_hash, 'HTML email'
+    )
+
+async def convert_image_to_pdf_async(image_data, filename, mime_type, content_hash=None):
+    """Async counterpart of convert_image_to_pdf_with_gotenberg"""
+    pdf_content = await asyncio.to_thread(convert_image_to_pdf_locally, image_data, filename)
+    if pdf_content:
+        return pdf_content
+    image_key = await asyncio.to_thread(image_cache_key, image_data, mime_type, content_hash)
+    cache_hash = pdf_cache.key_for(image_key)
+    return await conversions_in_flight.do_async(
+        cache_hash, convert_with_gotenberg_async, 'chromium_html',
+        lambda: build_image_request(image_data, filename, mime_type), image_key, cache_hash, f"image {filename}"
+    )
+
+async def convert_images_to_pdf_batch_async(images):
+    """Async counterpart of convert_images_to_pdf_batch, returns one PDF per image (converting misses one by one)"""
+    results = [None] * len(images)
+    missing = []
+    for i, (image_data, filename, mime_type, content_hash) in enumerate(images):
+        results[i] = await asyncio.to_thread(convert_image_to_pdf_locally, image_data, filename)
+        if results[i]:
+            continue
+        image_key = await asyncio.to_thread(image_cache_key, image_data, mime_type, content_hash)
+        cache_hash = pdf_cache.key_for(image_key)
+        cached_pdf = await cache_call(pdf_cache.get, image_key, cache_hash)
+        if cached_pdf:
+            logger.info(f"Using cached PDF for image {filename} ({len(cached_pdf)} bytes)")
+            results[i] = cached_pdf
+        else:
+            missing.append((i, (image_key, cache_hash)))
+    
+    if len(missing) > 1:
+        batch = [images[i] for i, _ in missing]
+        logger.info(f"Converting {len(batch)} images to PDF in one Gotenberg call")
+        pages = None
+        try:
+            files, data = await asyncio.to_thread(build_image_batch_request, batch)
+            response = await async_gotenberg.post('chromium_html', files=files, data=data)
+            if response.status_code == 200:
+                logger.info(f"✓ Successfully converted {len(batch)} images to PDF ({len(response.content)} bytes)")
+                pages = await asyncio.to_thread(split_image_batch, batch, [keys for _, keys in missing], response.content)
+            else:
+                logger.error(f"✗ Failed to convert image batch to PDF: {response.status_code}")
+        except Exception as e:
+            logger.error(f"✗ Exception converting image batch to PDF: {str(e)}")
+        
+        if pages:
+            for (i, _), page in zip(missing, pages):
+                results[i] = page
+            missing = []
+    
+    # Single misses, or a failed batch: convert one by one
+    if missing:
+        pdfs = await asyncio.gather(*(convert_image_to_pdf_async(*images[i]) for i, _ in missing))
+        for (i, _), pdf in zip(missing, pdfs):
+            results[i] = pdf
+    
+    return results
+
+async def convert_file_to_pdf_async(file_content, filename, content_type, content_hash=None):
+    """Async counterpart of convert_file_to_pdf_with_gotenberg"""
+    route = file_conversion_route(filename, file_content[:SNIFF_BYTES])
+    if route == 'pdf':
+        return await asyncio.to_thread(passthrough_pdf, file_content, filename)
+    if route == 'image':
+        # Image attachments are cached under their image key, same as the sync converter
+        return await convert_image_to_pdf_async(file_content, filename, content_type, content_hash)
+    elif route is None:
+        logger.warning(f"File type {file_extension(filename)} not supported for conversion")
+        return None
+    
+    file_key = await asyncio.to_thread(libreoffice_cache_key, file_content, filename, content_hash)
+    cache_hash = pdf_cache.key_for(file_key)
+    
+    def build_request():
+        files = {
+            'files': (filename, file_content, sniff_content_type(file_content[:SNIFF_BYTES], filename, content_type))
+        }
+        return files, None
+    
+    return await conversions_in_flight.do_async(
+        cache_hash, convert_with_gotenberg_async, 'libreoffice', build_request, file_key, cache_hash, filename
+    )
+
+async def convert_email_body_async(document, inline_assets=()):
+    """Async counterpart of convert_email_body, hashing and WeasyPrint run in worker threads"""
+    html_digest = await asyncio.to_thread(getattr, document, 'digest')
+    email_pdf_content = await convert_html_to_pdf_async(document.html, inline_assets, html_digest)
+    
+    if email_pdf_content is None:
+        logger.warning("Gotenberg failed for email HTML, trying WeasyPrint fallback")
+        email_pdf_content = await asyncio.to_thread(
+            convert_html_to_pdf_with_weasyprint, inline_assets_to_data_urls(document, inline_assets)
+        )
+    
+    if email_pdf_content is None:
+        raise Exception("Failed to convert email HTML to PDF with both methods")
+    
+    logger.info(f"✓ Email HTML converted to PDF ({len(email_pdf_content)} bytes)")
+    return email_pdf_content
+
+async def process_attachment_async(attachment, document, mode):
+    """Async counterpart of process_attachment"""
+    try:
+        filename = attachment.name
+        content_type = attachment.content_type
         
-        # Process results as they complete
-        for future in concurrent.futures.as_completed(attachment_futures):
-            result = future.result()
-            if result:
-                if result['success']:
-                    pdfs_to_merge.append({
-                        'name': result['pdf_name'],
-                        'content': result['content']
-                    })
-                    converted_attachments.append({
-                        'name': result['name'],
-                        'converted': True,
-                        'size': result['size']
-                    })
-                else:
-                    converted_attachments.append({
-                        'name': result['name'],
-                        'converted': False,
-                        'reason': result.get('reason', 'Unknown error')
-                    })
+        # In full mode, skip embedded images (they're already in the email content)
+        if mode == 'full' and is_embedded_image(attachment, document):
+            logger.info(f"Skipping embedded image {filename} in full mode (already in email content)")
+            return None
         
-        # Extract and convert embedded images if requested
-        image_pdfs = []
-        if extract_images:
-            logger.info("Image extraction requested - scanning HTML for embedded images...")
-            extracted_images = extract_images_from_html(html_content)
-            
-            # Keep track of which images we've already processed as attachments to avoid duplicates
-            processed_attachment_hashes = set()
-            for attachment in attachments:
-                if attachment.get('contentType', '').startswith('image/') or \
-                   attachment.get('name', '').lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')):
-                    try:
-                        # Create a hash of the attachment content to detect duplicates
-                        import hashlib
-                        file_content = base64.b64decode(attachment['content'])
-                        content_hash = hashlib.md5(file_content).hexdigest()
-                        processed_attachment_hashes.add(content_hash)
-                        logger.info(f"Added attachment {attachment['name']} to processed list (hash: {content_hash[:8]}...)")
-                    except:
-                        pass
-            
-            # Also look for CID references that match attachments (but don't process them separately)
-            cid_pattern = r'cid:([^"\'>\s]+)'
-            cid_matches = re.findall(cid_pattern, html_content, re.IGNORECASE)
-            
-            # Filter out extracted images that are duplicates of attachments
-            filtered_images = []
-            for image_info in extracted_images:
-                try:
-                    import hashlib
-                    image_hash = hashlib.md5(image_info['data']).hexdigest()
-                    
-                    if image_hash in processed_attachment_hashes:
-                        logger.info(f"Skipping duplicate image {image_info['filename']} - already processed as attachment (hash: {image_hash[:8]}...)")
-                        continue
-                    else:
-                        logger.info(f"Image {image_info['filename']} is unique, will process (hash: {image_hash[:8]}...)")
-                        filtered_images.append(image_info)
-                        
-                except Exception as e:
-                    logger.warning(f"Error checking image hash for {image_info['filename']}: {str(e)}")
-                    # If we can't hash it, include it to be safe
-                    filtered_images.append(image_info)
-            
-            logger.info(f"After deduplication: processing {len(filtered_images)} unique images out of {len(extracted_images)} extracted")
-            
-            for image_info in filtered_images:
-                try:
-                    logger.info(f"Converting extracted image {image_info['filename']} to PDF...")
-                    image_pdf_content = convert_image_to_pdf_with_gotenberg(
-                        image_info['data'], 
-                        image_info['filename'], 
-                        image_info['mime_type']
-                    )
-                    
-                    if image_pdf_content:
-                        # Use a cleaner name for the PDF
-                        base_name = Path(image_info['filename']).stem
-                        image_pdf_name = f"{base_name}.pdf"
-                        pdfs_to_merge.append({
-                            'name': image_pdf_name,
-                            'content': image_pdf_content
-                        })
-                        image_pdfs.append({
-                            'name': image_info['filename'],
-                            'pdf_name': image_pdf_name,
-                            'converted': True,
-                            'size': len(image_pdf_content),
-                            'is_cid': image_info.get('is_cid', False)
-                        })
-                        logger.info(f"✓ Successfully converted image {image_info['filename']} to PDF")
-                    else:
-                        logger.warning(f"✗ Failed to convert image {image_info['filename']} to PDF")
-                        image_pdfs.append({
-                            'name': image_info['filename'],
-                            'converted': False,
-                            'reason': 'Image to PDF conversion failed'
-                        })
-                        
-                except Exception as e:
-                    logger.error(f"Error converting image {image_info['filename']}: {str(e)}")
-                    image_pdfs.append({
-                        'name': image_info['filename'],
-                        'converted': False,
-                        'reason': f'Processing error: {str(e)}'
-                    })
+        route = file_conversion_route(filename, attachment.peek(SNIFF_BYTES))
+        if route is None:
+            return unsupported_attachment_result(filename)
+        
+        # Decoding and hashing large attachments would stall the event loop
+        file_content = await asyncio.to_thread(attachment.read)
+        logger.info(f"Processing attachment: {filename} ({content_type}, {len(file_content)} bytes)")
+        
+        if route == 'pdf':
+            pdf_content = await asyncio.to_thread(passthrough_pdf, file_content, filename)
+            attachment.release()
+            return attachment_result(filename, pdf_content, passthrough=True)
+        
+        content_hash = await asyncio.to_thread(getattr, attachment, 'digest')
+        pdf_content = await convert_file_to_pdf_async(file_content, filename, content_type, content_hash)
+        cache_hash = converted_file_cache_hash(route, file_content, filename, content_type, content_hash)
+        attachment.release()
+        return attachment_result(filename, pdf_content, cache_hash=cache_hash)
             
-            logger.info(f"Image extraction complete. Converted {len([p for p in image_pdfs if p['converted']])} out of {len(filtered_images)} unique images to PDF")
+    except Exception as e:
+        logger.error(f"Error processing attachment {attachment.name}: {str(e)}")
+        return {
+            'success': False,
+            'name': attachment.name,
+            'reason': f'Processing error: {str(e)}'
+        }
+
+async def run_conversion_pipeline_async(document, attachments, mode, extract_images, inline_assets=(), merge_engine=None):
+    """
+    Async counterpart of run_conversion_pipeline: the email body, every attachment and every
+    extracted image are converted concurrently, at most MAX_CONVERSIONS_PER_REQUEST at a time.
+    Results are assembled in the original order (email, attachments, images). While waiting
+    for later conversions, the ready ones are appended to merge_engine in a worker thread;
+    when nothing has to be waited for, nothing is appended (see run_conversion_pipeline).
+    
+    Returns:
+        tuple: (email_pdf_content, pdfs_to_merge, converted_attachments, image_pdfs)
+    """
+    semaphore = asyncio.Semaphore(MAX_CONVERSIONS_PER_REQUEST)
+    
+    async def bounded(coro):
+        async with semaphore:
+            return await coro
+    
+    # Scanning, decoding and hashing the images runs in a worker thread, off the event loop
+    filtered_images = await asyncio.to_thread(select_extracted_images, document, attachments) if extract_images else []
+    logger.info(f"Converting email, {len(attachments)} attachments and {len(filtered_images)} images concurrently")
+    
+    body_task = asyncio.ensure_future(bounded(convert_email_body_async(document, inline_assets)))
+    attachment_tasks = [
+        asyncio.ensure_future(bounded(process_attachment_async(attachment, document, mode)))
+        for attachment in attachments
+    ]
+    images = [image_conversion_args(image_info) for image_info in filtered_images]
+    batch_images = BATCH_IMAGES and len(images) > 1
+    if batch_images:
+        image_tasks = [asyncio.ensure_future(bounded(convert_images_to_pdf_batch_async(images)))]
+    else:
+        image_tasks = [asyncio.ensure_future(bounded(convert_image_to_pdf_async(*image))) for image in images]
+    
+    try:
+        email_pdf_content = await body_task
+    except Exception:
+        for task in attachment_tasks + image_tasks:
+            task.cancel()
+        await asyncio.gather(*attachment_tasks, *image_tasks, return_exceptions=True)
+        raise
+    
+    pdfs_to_merge = [{
+        'name': 'email.pdf',
+        'content': email_pdf_content,
+        'cache_hash': pdf_cache.key_for(email_html_cache_key(document.html, inline_assets, document.digest))
+    }]
+    
+    async def append_while_waiting(tasks):
+        # Merge what is ready only if the next results would otherwise be waited for
+        if merge_engine and tasks:
+            _, pending = await asyncio.wait(tasks, timeout=MERGE_WAIT)
+            if pending:
+                await asyncio.to_thread(merge_engine.append_pending, pdfs_to_merge)
+    
+    converted_attachments = []
+    for task in attachment_tasks:
+        await append_while_waiting([task])
+        add_attachment_result(await task, pdfs_to_merge, converted_attachments)
+    
+    image_pdfs = []
+    await append_while_waiting(image_tasks)
+    image_results = await asyncio.gather(*image_tasks, return_exceptions=True)
+    if batch_images:
+        # A single task holds the PDFs of the whole batch
+        batch_result = image_results[0]
+        image_results = [batch_result] * len(images) if isinstance(batch_result, Exception) else batch_result
+    for image_info, result in zip(filtered_images, image_results):
+        if isinstance(result, Exception):
+            logger.error(f"Error converting image {image_info['filename']}: {str(result)}")
+            image_pdfs.append({
+                'name': image_info['filename'],
+                'converted': False,
+                'reason': f'Processing error: {str(result)}'
+            })
+        else:
+            add_image_result(image_info, result, pdfs_to_merge, image_pdfs)
+    
+    if extract_images:
+        logger.info(f"Image extraction complete. Converted {len([p for p in image_pdfs if p['converted']])} out of {len(filtered_images)} unique images to PDF")
+    
+    return email_pdf_content, pdfs_to_merge, converted_attachments, image_pdfs
+
+async def merge_pdfs_with_gotenberg_async(pdfs_to_merge, output_path):
+    """Async counterpart of merge_pdfs_with_gotenberg, always writes to output_path"""
+    merged = None
+    try:
+        response = await async_gotenberg.post('merge', files=build_merge_request(pdfs_to_merge))
+        if response.status_code == 200:
+            logger.info(f"Successfully merged {len(pdfs_to_merge)} PDFs")
+            await asyncio.to_thread(write_pdf_file, output_path, response.content)
+            merged = output_path
+        else:
+            logger.error(f"Gotenberg merge failed: {response.status_code} - {response.text}")
+    except Exception as e:
+        logger.error(f"Error merging PDFs: {str(e)}")
+    return merged
+
+async def merge_pdfs_async(pdfs_to_merge, output_path, merge_engine=None):
+    """Async counterpart of merge_pdfs, the local merge runs in a worker thread"""
+    if len(pdfs_to_merge) == 1:
+        await asyncio.to_thread(write_pdf_file, output_path, pdfs_to_merge[0]['content'])
+        return True
+    
+    logger.info(f"Merging {len(pdfs_to_merge)} PDFs...")
+    
+    if MERGE_ENGINE == 'gotenberg':
+        merged = await merge_pdfs_with_gotenberg_async(pdfs_to_merge, output_path)
+        if not merged:
+            logger.info("Gotenberg merge failed, trying local merge...")
+            merged = await asyncio.to_thread(merge_pdfs_locally, pdfs_to_merge, output_path)
+    else:
+        merged = await asyncio.to_thread(merge_pdfs_locally, pdfs_to_merge, output_path, merge_engine)
+        if not merged:
+            logger.info("Local merge failed, trying Gotenberg merge...")
+            merged = await merge_pdfs_with_gotenberg_async(pdfs_to_merge, output_path)
+    
+    if not merged:
+        logger.error("Both merge methods failed, returning email PDF only")
+        await asyncio.to_thread(write_pdf_file, output_path, pdfs_to_merge[0]['content'])
+        return False
+    return True
+
+def parse_conversion_request():
+    """
+    Read a /convert-with-attachments request, either JSON with base64 attachments or
+    multipart/form-data with the HTML as a field or file part and one file part per attachment.
+    
+    Returns:
+        tuple: (html_content, attachments as EmailAttachment list, mode, extract_images)
+    """
+    if request.mimetype == 'multipart/form-data':
+        html_content = request.form.get('html', '')
+        if not html_content and 'html' in request.files:
+            html_content = request.files['html'].read().decode('utf-8', errors='replace')
+        attachments = [EmailAttachment.from_upload(part) for part in request.files.getlist('attachments')]
+        mode = request.form.get('mode', 'full')
+        extract_images = request.form.get('extractImages', 'false').lower() == 'true'
+        return html_content, attachments, mode, extract_images
+    
+    data = request.get_json()
+    html_content = data.get('html', '')
+    attachments = [EmailAttachment.from_json(attachment) for attachment in data.get('attachments', [])]
+    mode = data.get('mode', 'full')  # 'full' or 'individual'
+    extract_images = data.get('extractImages', False)  # Whether to extract embedded images
+    return html_content, attachments, mode, extract_images
+
+@app.route('/convert-with-attachments', methods=['POST'])
+def convert_with_attachments():
+    """Convert HTML email to PDF and include converted attachments (JSON or multipart/form-data)"""
+    try:
+        html_content, attachments, mode, extract_images = parse_conversion_request()
+        
+        if not html_content:
+            return jsonify({'error': 'No HTML content provided'}), 400
+        
+        # The same request again (e.g. repeated clicks on one message) returns the recorded result
+        html_digest = content_digest(html_content)
+        fingerprint = request_fingerprint(html_digest, attachments, mode, extract_images)
+        cached_result = cached_conversion_result(fingerprint)
+        if cached_result is not None:
+            merged_path, pdf_files = cached_result
+            logger.info(f"Using cached result for request {fingerprint[:8]}...")
+            if mode == 'individual':
+                return individual_pdfs_response(pdf_files)
+            if merged_path is not None:
+                return send_merged_pdf(merged_path, 'email_with_attachments.pdf')
+            return merged_pdf_response(pdf_files[0]['content'])
+        
+        # Scan the HTML once for image and CID references, every step below reads the scan
+        document = HtmlDocument.parse(html_content, html_digest)
+        
+        # Resolve CID image references in the HTML before converting to PDF,
+        # as separate image files for Gotenberg or inlined as data: URLs
+        inline_assets = []
+        if attachments:
+            if INLINE_IMAGE_ASSETS:
+                document, inline_assets = resolve_cid_images_as_assets(document, attachments)
+            else:
+                document = resolve_cid_images_in_html(document, attachments)
+        
+        # In full mode, PDFs are merged locally as they become ready
+        merge_engine = PdfMergeEngine() if mode != 'individual' and MERGE_ENGINE != 'gotenberg' else None
         
-        logger.info(f"Attachment processing complete. Total PDFs ready: {len(pdfs_to_merge)} (1 email + {len(pdfs_to_merge)-1} converted files)")
+        if ASYNC_PIPELINE:
+            email_pdf_content, pdfs_to_merge, converted_attachments, image_pdfs = run_async(
+                run_conversion_pipeline_async(document, attachments, mode, extract_images, inline_assets, merge_engine)
+            )
+        else:
+            email_pdf_content, pdfs_to_merge, converted_attachments, image_pdfs = run_conversion_pipeline(
+                document, attachments, mode, extract_images, inline_assets, merge_engine
+            )
+        
+        passthrough_count = sum(1 for pdf_file in pdfs_to_merge if pdf_file.get('passthrough'))
+        logger.info(f"Attachment processing complete. Total PDFs ready: {len(pdfs_to_merge)} (1 email + {len(pdfs_to_merge)-1-passthrough_count} converted files + {passthrough_count} PDF attachments)")
+        
+        complete = conversion_is_complete(converted_attachments, image_pdfs)
         
         # Handle different modes
         if mode == 'individual':
             # Individual mode: prepare separate PDFs and return download info
             logger.info(f"Preparing individual PDFs with {len(pdfs_to_merge)} files...")
-            
-            # Store PDFs temporarily with unique IDs for download
-            pdf_downloads = []
-            
-            # Add email PDF
-            email_id = f"email_{int(time.time())}"
-            temp_pdfs[email_id] = {
-                'content': email_pdf_content,
-                'filename': 'email.pdf',
-                'created_at': time.time()
-            }
-            pdf_downloads.append({
-                'id': email_id,
-                'filename': 'email.pdf',
-                'size': len(email_pdf_content),
-                'download_url': f'/download-pdf/{email_id}'
-            })
-            
-            # Add each converted attachment PDF
-            for i, pdf_file in enumerate(pdfs_to_merge[1:], 1):  # Skip the first one (email)
-                pdf_id = f"attachment_{i}_{int(time.time())}"
-                temp_pdfs[pdf_id] = {
-                    'content': pdf_file['content'],
-                    'filename': pdf_file['name'],
-                    'created_at': time.time()
-                }
-                pdf_downloads.append({
-                    'id': pdf_id,
-                    'filename': pdf_file['name'],
-                    'size': len(pdf_file['content']),
-                    'download_url': f'/download-pdf/{pdf_id}'
-                })
-            
-            # Return JSON with download information
-            return jsonify({
-                'mode': 'individual',
-                'pdfs': pdf_downloads,
-                'total_count': len(pdf_downloads),
-                'message': 'Individual PDFs prepared for download'
-            })
+            response = individual_pdfs_response(pdfs_to_merge)
+            if complete:
+                cache_conversion_result(fingerprint, pdfs_to_merge)
+            return response
             
         else:
-            # Full mode: merge all PDFs into one
-            if len(pdfs_to_merge) > 1:
-                logger.info(f"Merging {len(pdfs_to_merge)} PDFs...")
-                
-                # Try Gotenberg merge first
-                merged_pdf = merge_pdfs_with_gotenberg(pdfs_to_merge)
-                
-                # Fallback to PyPDF2 if Gotenberg fails
-                if not merged_pdf:
-                    logger.info("Gotenberg merge failed, trying PyPDF2 fallback...")
-                    merged_pdf = fallback_merge_pdfs(pdfs_to_merge)
-                
-                if not merged_pdf:
-                    logger.error("Both merge methods failed, returning email PDF only")
-                    merged_pdf = email_pdf_content
-            else:
-                merged_pdf = email_pdf_content
+            # Full mode: merge all PDFs into one file on disk
+            # (in the download directory, so a crashed request's file is cleaned up with expired downloads)
+            fd, merged_path = tempfile.mkstemp(prefix='merged_', suffix='.pdf', dir=DOWNLOAD_DIR)
+            os.close(fd)
+            try:
+                # The same parts in the same order give the same merged PDF
+                merged_hash = merged_cache_key(pdfs_to_merge, mode) if len(pdfs_to_merge) > 1 else None
+                if merged_hash and merged_pdf_cache.get_file(merged_hash, merged_path):
+                    # Copied by path, the cached PDF is never loaded into memory
+                    logger.info(f"Using cached merged PDF ({os.path.getsize(merged_path)} bytes)")
+                    reusable = True
+                else:
+                    if ASYNC_PIPELINE:
+                        merged = run_async(merge_pdfs_async(pdfs_to_merge, merged_path, merge_engine))
+                    else:
+                        merged = merge_pdfs(pdfs_to_merge, merged_path, merge_engine)
+                    reusable = merged and (merged_hash is None or cache_merged_pdf(merged_hash, merged_path))
+                if reusable and complete:
+                    cache_conversion_result(fingerprint, pdfs_to_merge, merged_hash)
+            except Exception:
+                os.unlink(merged_path)
+                raise
             
-            # Return the merged PDF directly as a file
-            return send_file(
-                io.BytesIO(merged_pdf),
-                as_attachment=True,
-                download_name='email_with_attachments.pdf',
-                mimetype='application/pdf'
-            )
+            # The inputs are no longer needed once merged, release them before sending
+            pdfs_to_merge.clear()
+            del email_pdf_content, merge_engine
+            
+            # Return the merged PDF file, streamed from disk
+            return send_merged_pdf(merged_path, 'email_with_attachments.pdf')
         
     except Exception as e:
         logger.error(f"Error in convert_with_attachments: {str(e)}")
@@ -1083,13 +2215,15 @@ def convert_with_attachments_debug():
         if len(pdfs_to_merge) > 1:
             logger.info(f"Merging {len(pdfs_to_merge)} PDFs...")
             
-            # Try Gotenberg merge first
-            merged_pdf = merge_pdfs_with_gotenberg(pdfs_to_merge)
+            # Merge locally first, Gotenberg is the fallback
+            merged_stream = io.BytesIO()
+            merged_pdf = None
+            if merge_pdfs_locally(pdfs_to_merge, merged_stream):
+                merged_pdf = merged_stream.getvalue()
             
-            # Fallback to PyPDF2 if Gotenberg fails
             if not merged_pdf:
-                logger.info("Gotenberg merge failed, trying PyPDF2 fallback...")
-                merged_pdf = fallback_merge_pdfs(pdfs_to_merge)
+                logger.info("Local merge failed, trying Gotenberg merge...")
+                merged_pdf = merge_pdfs_with_gotenberg(pdfs_to_merge)
             
             if not merged_pdf:
                 logger.error("Both merge methods failed, returning email PDF only")
@@ -1115,12 +2249,9 @@ def test_gotenberg():
     """Test endpoint to check Gotenberg connectivity and capabilities"""
     try:
         # Test basic connectivity
-        health_response = requests.get(f"{GOTENBERG_URL}/health", timeout=5)
-        
-        if health_response.status_code != 200:
+        if not gotenberg.health(timeout=5):
             return jsonify({
-                'error': 'Gotenberg health check failed',
-                'status_code': health_response.status_code
+                'error': 'Gotenberg health check failed'
             }), 500
         
         # Test a simple conversion
@@ -1136,11 +2267,7 @@ def test_gotenberg():
             'files': ('test.html', test_html, 'text/html')
         }
         
-        convert_response = requests.post(
-            f"{GOTENBERG_URL}/forms/libreoffice/convert",
-            files=files,
-            timeout=10
-        )
+        convert_response = gotenberg.post('libreoffice', files=files, timeout=10)
         
         if convert_response.status_code == 200:
             return jsonify({
@@ -1163,22 +2290,25 @@ def test_gotenberg():
 @app.route('/download-pdf/<pdf_id>', methods=['GET'])
 def download_pdf(pdf_id):
     """Download a specific PDF by ID"""
-    if pdf_id not in temp_pdfs:
+    stored_pdf = load_temp_pdf(pdf_id)
+    if stored_pdf is None:
         return jsonify({'error': 'PDF not found or expired'}), 404
     
-    pdf_data = temp_pdfs[pdf_id]
-    pdf_content = pdf_data['content']
-    filename = pdf_data['filename']
-    
-    # Create a BytesIO object with the PDF content
-    pdf_io = io.BytesIO(pdf_content)
+    pdf_path, filename = stored_pdf
     
     return send_file(
-        pdf_io,
+        pdf_path,
         mimetype='application/pdf',
         as_attachment=True,
-        download_name=filename
+        download_name=filename,
+        conditional=True
     )
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Development server only; production runs under gunicorn (see gunicorn.conf.py)
+    warm_up()
+    app.run(
+        host='0.0.0.0',
+        port=int(os.environ.get('PORT', '5000')),
+        debug=os.environ.get('DEBUG', 'true').lower() == 'true'
+    )
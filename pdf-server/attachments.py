@@ -0,0 +1,167 @@
+"""
+Email attachment module for the PDF server.
+Wraps attachments from either request format behind one interface:
+base64 strings from a JSON request, or file parts from a multipart
+upload (spooled to disk by the request parser above a size threshold).
+Content is only materialized when a conversion step asks for it, and
+base64 payloads are decoded once per request: the decoded bytes, their
+digest and size are shared by every step that needs them.
+"""
+import base64
+import binascii
+import logging
+import threading
+
+import hashing
+from formats import is_image_file
+
+logger = logging.getLogger(__name__)
+
+class EmailAttachment:
+    """
+    An email attachment with its name, content type and content.
+    """
+
+    def __init__(self, name, content_type, content_base64=None, stream=None):
+        """
+        Initialize the attachment, from exactly one of content_base64 or stream.
+
+        Args:
+            name: Attachment filename
+            content_type: MIME type reported by the client
+            content_base64: Base64 encoded content (JSON requests)
+            stream: Seekable binary file object with the raw content (multipart uploads)
+        """
+        self.name = name
+        self.content_type = content_type
+        self.content_base64 = content_base64
+        self.stream = stream
+        # Conversion threads may read an upload concurrently, reads seek the shared stream
+        self.lock = threading.Lock()
+        self.content = None   # Decoded JSON payload, kept until release()
+        self._digest = None
+        self._source_digest = None
+        self._size = None
+
+    @classmethod
+    def from_json(cls, attachment):
+        """Create an attachment from a JSON request entry {name, contentType, content}"""
+        return cls(
+            attachment.get('name', 'unknown'),
+            attachment.get('contentType', 'application/octet-stream'),
+            content_base64=attachment.get('content', '')
+        )
+
+    @classmethod
+    def from_upload(cls, file_storage):
+        """Create an attachment from a multipart file part (werkzeug FileStorage)"""
+        return cls(
+            file_storage.filename or 'unknown',
+            file_storage.mimetype or 'application/octet-stream',
+            stream=file_storage.stream
+        )
+
+    def read(self):
+        """
+        Get the raw attachment content.
+
+        Returns:
+            bytes: The decoded content
+        """
+        with self.lock:
+            if self.stream is None:
+                if self.content is None:
+                    self.content = base64.b64decode(self.content_base64)
+                    self._size = len(self.content)
+                return self.content
+            # Uploads are read back from their spool file instead of being kept in memory
+            self.stream.seek(0)
+            return self.stream.read()
+
+    def peek(self, size):
+        """
+        Get the first bytes of the content, e.g. to sniff its type, without decoding
+        or reading all of it.
+
+        Args:
+            size: Number of bytes wanted
+
+        Returns:
+            bytes: Up to size bytes from the start of the content
+        """
+        if self.stream is None:
+            if self.content is not None:
+                return self.content[:size]
+            try:
+                # 4 base64 characters per 3 bytes
+                return base64.b64decode(self.content_base64[:(size + 2) // 3 * 4])[:size]
+            except (binascii.Error, ValueError):
+                # Line breaks or padding in the prefix, decode it all
+                return self.read()[:size]
+        with self.lock:
+            self.stream.seek(0)
+            return self.stream.read(size)
+
+    @property
+    def digest(self):
+        """Hex digest of the raw content (hashing.digest), computed once"""
+        if self._digest is None:
+            if self.stream is None:
+                self._digest = hashing.digest(self.read())
+            else:
+                # Uploads are hashed from their spool file without loading them whole
+                with self.lock:
+                    self.stream.seek(0)
+                    self._digest = hashing.stream_digest(self.stream)
+        return self._digest
+
+    @property
+    def source_digest(self):
+        """
+        Hex digest of the content as received, computed once: of the base64 text for JSON
+        requests, so it needs no decoding, and the same as digest for uploads.
+
+        For JSON requests this is a second hash next to digest. It is a trade-off: the
+        request fingerprint can be checked without decoding any attachment, and only a
+        request that misses the result cache also hashes the decoded bytes. Conversions
+        stay keyed on digest, so the same file cached from a JSON request and from an
+        upload, or found as an embedded image, shares one cache entry.
+        """
+        if self.stream is not None:
+            return self.digest
+        if self._source_digest is None:
+            self._source_digest = hashing.digest(self.content_base64 or '')
+        return self._source_digest
+
+    @property
+    def size(self):
+        """Size of the raw content in bytes"""
+        if self._size is None:
+            if self.stream is None:
+                self.read()
+            else:
+                with self.lock:
+                    self.stream.seek(0, 2)
+                    self._size = self.stream.tell()
+        return self._size
+
+    def release(self):
+        """Drop the decoded content once it has been converted (digest and size are kept)"""
+        with self.lock:
+            self.content = None
+
+    def to_base64(self):
+        """Get the content base64 encoded, e.g. for a data: URL"""
+        if self.stream is None:
+            return self.content_base64
+        return base64.b64encode(self.read()).decode('ascii')
+
+    def has_content(self):
+        """Check whether the attachment has any content"""
+        if self.stream is None:
+            return bool(self.content_base64)
+        return self.size > 0
+
+    def is_image(self):
+        """Check whether the attachment looks like an image by content type or extension"""
+        return is_image_file(self.name, self.content_type)
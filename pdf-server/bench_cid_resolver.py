@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Benchmark for resolve_cid_images_in_html.
+
+Compares the single-pass resolver against the previous implementation,
+which looped over every CID and every attachment and rewrote the whole
+HTML twice per resolved CID. Checks that both produce identical HTML.
+
+Usage:
+    python bench_cid_resolver.py [--images 100 200 500] [--image-kb 20]
+"""
+import argparse
+import base64
+import logging
+import os
+import random
+import re
+import time
+from pathlib import Path
+
+from attachments import EmailAttachment
+
+
+def legacy_resolve_cid_images_in_html(html_content, attachments):
+    """The resolver before the single-pass rewrite, kept as the baseline"""
+    try:
+        cid_pattern = r'src=["\']cid:([^"\']+)["\']'
+        cid_matches = re.findall(cid_pattern, html_content, re.IGNORECASE)
+
+        for cid in cid_matches:
+            for attachment in attachments:
+                attachment_name = attachment.name
+                content_type = attachment.content_type
+
+                if cid in attachment_name or attachment.is_image():
+                    try:
+                        if not attachment.has_content():
+                            continue
+                        image_data = attachment.to_base64()
+
+                        if not content_type or not content_type.startswith('image/'):
+                            file_ext = Path(attachment_name).suffix.lower()
+                            content_type = {
+                                '.jpg': 'image/jpeg',
+                                '.jpeg': 'image/jpeg',
+                                '.png': 'image/png',
+                                '.gif': 'image/gif',
+                                '.bmp': 'image/bmp',
+                                '.webp': 'image/webp'
+                            }.get(file_ext, 'image/jpeg')
+
+                        data_url = f"data:{content_type};base64,{image_data}"
+                        html_content = html_content.replace(f'src="cid:{cid}"', f'src="{data_url}"')
+                        html_content = html_content.replace(f"src='cid:{cid}'", f"src='{data_url}'")
+                        break
+                    except Exception:
+                        pass
+
+        return html_content
+    except Exception:
+        return html_content
+
+
+def make_email(images, image_kb, seed=0):
+    """Build an email with `images` inline CID images plus a few other attachments"""
+    rng = random.Random(seed)
+    attachments = [EmailAttachment('report.docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+                                   content_base64=base64.b64encode(os.urandom(1024)).decode())]
+    parts = ['<html><body><p>Hello</p>']
+    for i in range(images):
+        name = f"image{i:03d}.png"
+        attachments.append(EmailAttachment(name, rng.choice(['image/png', '', 'application/octet-stream']),
+                                           content_base64=base64.b64encode(os.urandom(image_kb * 1024)).decode()))
+        quote = rng.choice(['"', "'"])
+        parts.append(f'<p>Paragraph {i}</p><img src={quote}cid:{name}@example.com{quote} alt="{name}">')
+    parts.append('<img src="cid:unknown"></body></html>')
+    return ''.join(parts), attachments
+
+
+def timed(fn, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, nargs='+', default=[100, 200, 500])
+    parser.add_argument('--image-kb', type=int, default=20, help='Size of each inline image in KB')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    from app import resolve_cid_images_in_html
+    from html_scan import HtmlDocument
+
+    def resolve(html, attachments):
+        return resolve_cid_images_in_html(HtmlDocument.parse(html), attachments).html
+
+    print(f"{'images':>8} {'html MB':>8} {'legacy s':>10} {'single-pass s':>14} {'speedup':>8} {'identical':>10}")
+    for images in args.images:
+        html, attachments = make_email(images, args.image_kb)
+        legacy_time, legacy_html = timed(legacy_resolve_cid_images_in_html, html, attachments)
+        new_time, new_html = timed(resolve, html, attachments)
+        print(f"{images:>8} {len(new_html) / 1e6:>8.1f} {legacy_time:>10.3f} {new_time:>14.4f} "
+              f"{legacy_time / new_time:>7.0f}x {str(new_html == legacy_html):>10}")
+
+
+if __name__ == '__main__':
+    main()
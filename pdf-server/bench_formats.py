@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the formats module.
+
+Replays the format lookups one email makes (routing each attachment,
+picking MIME types and extensions for inline and extracted images,
+checking which attachments are images, matching data: URLs and asset
+extensions) with the inline dict literals, per-call extension sets and
+string regex patterns the conversion code used before, and with the
+module-level tables and precompiled patterns in formats.
+
+Usage:
+    python bench_formats.py [--attachments 10] [--images 20] [--emails 2000]
+"""
+import argparse
+import re
+import time
+from pathlib import Path
+
+import formats
+
+
+def legacy_file_conversion_route(filename):
+    file_ext = Path(filename).suffix.lower()
+    supported_extensions = {
+        '.docx', '.doc', '.odt', '.rtf',
+        '.xlsx', '.xls', '.ods',
+        '.pptx', '.ppt', '.odp',
+        '.txt', '.csv',
+        '.html', '.htm'
+    }
+    image_extensions = {
+        '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'
+    }
+    if file_ext in image_extensions:
+        return 'image'
+    if file_ext in supported_extensions:
+        return 'libreoffice'
+    return None
+
+
+def legacy_image_mime_type(mime_type, filename):
+    if not mime_type or not mime_type.startswith('image/'):
+        file_ext = Path(filename).suffix.lower()
+        mime_type = {
+            '.jpg': 'image/jpeg',
+            '.jpeg': 'image/jpeg',
+            '.png': 'image/png',
+            '.gif': 'image/gif',
+            '.bmp': 'image/bmp',
+            '.webp': 'image/webp'
+        }.get(file_ext, 'image/jpeg')
+    return mime_type
+
+
+def legacy_image_extension(mime_type):
+    return {
+        'image/jpeg': '.jpg',
+        'image/jpg': '.jpg',
+        'image/png': '.png',
+        'image/gif': '.gif',
+        'image/bmp': '.bmp',
+        'image/webp': '.webp'
+    }.get(mime_type, '.jpg')
+
+
+def legacy_is_image(name, content_type):
+    return (content_type.startswith('image/') or
+            name.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')))
+
+
+def legacy_email(attachments, images, data_urls):
+    for name, content_type in attachments:
+        legacy_is_image(name, content_type)
+        legacy_file_conversion_route(name)
+    for name, content_type in images:
+        legacy_is_image(name, content_type)
+        legacy_image_mime_type(content_type, name)
+        re.fullmatch(r'\.[a-z0-9]{1,5}', Path(name).suffix.lower())
+    for src in data_urls:
+        match = re.match(r'data:([^;]+);base64,(.+)', src)
+        legacy_image_extension(match.group(1))
+
+
+def new_email(attachments, images, data_urls):
+    for name, content_type in attachments:
+        formats.is_image_file(name, content_type)
+        formats.sniff_content_type(b'PK\x03\x04' + bytes(12), name)
+        route = formats.file_extension(name)
+        route in formats.IMAGE_EXTENSIONS or route in formats.OFFICE_EXTENSIONS
+    for name, content_type in images:
+        formats.is_image_file(name, content_type)
+        formats.image_mime_type(content_type, name)
+        formats.SAFE_EXTENSION_PATTERN.fullmatch(formats.file_extension(name))
+    for src in data_urls:
+        match = formats.DATA_URL_PATTERN.match(src)
+        formats.image_extension(match.group(1))
+
+
+def make_email(attachments, images):
+    """Attachment (name, content type) pairs, inline image pairs and data: URLs for one email"""
+    kinds = ['report.docx', 'budget.xlsx', 'slides.pptx', 'notes.txt', 'scan.pdf', 'photo.JPG']
+    attachment_list = [(f"{i}_{kinds[i % len(kinds)]}", 'application/octet-stream') for i in range(attachments)]
+    image_list = [(f"image{i:03d}.png", '' if i % 2 else 'image/png') for i in range(images)]
+    data_urls = [f"data:image/png;base64,{'A' * 4096}" for _ in range(images // 4)]
+    return attachment_list, image_list, data_urls
+
+
+def timed(fn, email, emails):
+    start = time.perf_counter()
+    for _ in range(emails):
+        fn(*email)
+    return (time.perf_counter() - start) / emails
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--attachments', type=int, default=10)
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--emails', type=int, default=2000)
+    args = parser.parse_args()
+
+    email = make_email(args.attachments, args.images)
+    # Warm up the re module cache and the interpreter
+    timed(legacy_email, email, 100)
+    timed(new_email, email, 100)
+
+    legacy_time = timed(legacy_email, email, args.emails)
+    new_time = timed(new_email, email, args.emails)
+    print(f"{args.attachments} attachments, {args.images} inline images per email")
+    print(f"{'legacy us/email':>16} {'formats us/email':>17} {'saved us':>9} {'speedup':>8}")
+    print(f"{legacy_time * 1e6:>16.1f} {new_time * 1e6:>17.1f} {(legacy_time - new_time) * 1e6:>9.1f} "
+          f"{legacy_time / new_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Concurrency benchmark for PdfCache.
+
+Compares the striped cache (blob I/O outside the index locks) against a
+baseline that serializes every get/put behind one global lock, the way the
+cache worked when disk reads and writes happened under its RLock.
+
+Usage:
+    python bench_pdf_cache.py [--io-delay 0.002] [--seconds 2]
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from pdf_cache import PdfCache
+
+
+class SerializedPdfCache(PdfCache):
+    """Baseline: one lock held for the whole get/put, including disk I/O"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, shards=1, **kwargs)
+        self.global_lock = threading.RLock()
+
+    def get(self, content, content_hash=None):
+        with self.global_lock:
+            return super().get(content, content_hash)
+
+    def put(self, content, pdf_content, content_hash=None):
+        with self.global_lock:
+            return super().put(content, pdf_content, content_hash)
+
+
+def add_io_delay(cache, delay):
+    """Simulate a slow cache volume by sleeping around blob reads and writes"""
+    read_blob, write_blob = cache._read_blob, cache._write_blob
+
+    def slow_read(*args, **kwargs):
+        time.sleep(delay)
+        return read_blob(*args, **kwargs)
+
+    def slow_write(*args, **kwargs):
+        time.sleep(delay)
+        return write_blob(*args, **kwargs)
+
+    cache._read_blob, cache._write_blob = slow_read, slow_write
+
+
+def run(cache_class, threads, seconds, io_delay, keys=200, pdf_size=64 * 1024):
+    cache_dir = tempfile.mkdtemp(prefix='pdf_cache_bench_')
+    try:
+        cache = cache_class(cache_dir=cache_dir, max_entries=keys * 2, ttl=3600, max_bytes=keys * pdf_size * 2)
+        add_io_delay(cache, io_delay)
+        pdf = b'%PDF-1.4\n' + b'x' * pdf_size
+        for i in range(keys):
+            cache.put(f"document-{i}", pdf)
+
+        ops = [0] * threads
+        stop = time.time() + seconds
+
+        def worker(n):
+            rng = random.Random(n)
+            while time.time() < stop:
+                key = f"document-{rng.randrange(keys)}"
+                if rng.random() < 0.9:
+                    cache.get(key)
+                else:
+                    cache.put(key, pdf)
+                ops[n] += 1
+
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        return sum(ops) / seconds
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--io-delay', type=float, default=0.002, help='Simulated disk latency per blob read/write (seconds)')
+    parser.add_argument('--seconds', type=float, default=2.0, help='Duration of each run')
+    parser.add_argument('--threads', type=int, nargs='+', default=[4, 8, 16, 32])
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)
+
+    print(f"{'threads':>8} {'serialized ops/s':>18} {'striped ops/s':>15} {'speedup':>8}")
+    for threads in args.threads:
+        baseline = run(SerializedPdfCache, threads, args.seconds, args.io_delay)
+        striped = run(PdfCache, threads, args.seconds, args.io_delay)
+        print(f"{threads:>8} {baseline:>18.0f} {striped:>15.0f} {striped / baseline:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Append-only journal for the file-based PDF cache index.
+Every index change is one small line appended to the journal, so updates
+are O(1) and a crash can at worst lose or tear the last line. Lines are
+written with a single O_APPEND write, so worker processes sharing the
+cache directory can append to the same journal.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Journal record types
+PUT = 'P'     # P <key> <timestamp> <size>
+TOUCH = 'T'   # T <key> <timestamp>
+REMOVE = 'D'  # D <key>
+
+
+class CacheJournal:
+    """
+    Append-only journal of cache index operations.
+    The journal is periodically compacted into a snapshot of the live
+    entries, written to a temporary file and atomically renamed in place.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize the journal.
+
+        Args:
+            path: Path of the journal file
+        """
+        self.path = str(path)
+        self.lock = threading.Lock()
+        self.records = 0
+        self.file = None
+        self.last_checked = 0
+
+    def replay(self):
+        """
+        Replay the journal into an index.
+
+        Returns:
+            dict: {key: (timestamp, size)} for live entries, in journal order
+        """
+        index = {}
+        self.records = 0
+        if not os.path.exists(self.path):
+            return index
+
+        with open(self.path, 'r', encoding='ascii', errors='replace') as f:
+            for line in f:
+                parts = line.split()
+                self.records += 1
+                try:
+                    if parts[0] == PUT and len(parts) == 4:
+                        index.pop(parts[1], None)
+                        index[parts[1]] = (float(parts[2]), int(parts[3]))
+                    elif parts[0] == TOUCH and len(parts) == 3:
+                        if parts[1] in index:
+                            _, size = index.pop(parts[1])
+                            index[parts[1]] = (float(parts[2]), size)
+                    elif parts[0] == REMOVE and len(parts) == 2:
+                        index.pop(parts[1], None)
+                    else:
+                        raise ValueError(line)
+                except (IndexError, ValueError):
+                    # Torn or corrupt line (e.g. process died mid-append), skip it
+                    logger.warning(f"Skipping corrupt cache journal line: {line[:80]!r}")
+
+        return index
+
+    def _reopen_if_replaced(self):
+        """
+        Reopen the journal if another process sharing the cache directory
+        compacted it (replaced the file), so appends don't go to the old file.
+        """
+        now = time.time()
+        if now - self.last_checked < 1.0:
+            return
+        self.last_checked = now
+        try:
+            if os.stat(self.path).st_ino == os.fstat(self.file.fileno()).st_ino:
+                return
+        except OSError:
+            pass
+        self.file.close()
+        self.file = open(self.path, 'a', encoding='ascii')
+
+    def _append(self, line):
+        with self.lock:
+            try:
+                if self.file is None:
+                    self.file = open(self.path, 'a', encoding='ascii')
+                else:
+                    self._reopen_if_replaced()
+                self.file.write(line)
+                self.file.flush()
+                self.records += 1
+            except Exception as e:
+                logger.error(f"Failed to append to cache journal: {str(e)}")
+
+    def record_put(self, key, timestamp, size):
+        self._append(f"{PUT} {key} {timestamp:.3f} {size}\n")
+
+    def record_touch(self, key, timestamp):
+        self._append(f"{TOUCH} {key} {timestamp:.3f}\n")
+
+    def record_remove(self, key):
+        self._append(f"{REMOVE} {key}\n")
+
+    def compact(self, entries):
+        """
+        Rewrite the journal as a snapshot of the live entries.
+
+        Args:
+            entries: Iterable of (key, timestamp, size) in LRU order
+        """
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with self.lock:
+            try:
+                count = 0
+                with open(tmp_path, 'w', encoding='ascii') as f:
+                    for key, timestamp, size in entries:
+                        f.write(f"{PUT} {key} {timestamp:.3f} {size}\n")
+                        count += 1
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+
+                if self.file is not None:
+                    self.file.close()
+                self.file = open(self.path, 'a', encoding='ascii')
+                self.records = count
+            except Exception as e:
+                logger.error(f"Failed to compact cache journal: {str(e)}")
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
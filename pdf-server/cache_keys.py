@@ -0,0 +1,51 @@
+"""
+Cache key module for the PDF server.
+A cache key says what was converted and how: the conversion route (which
+also names the engine), a version of the template and renderer options
+used on that route, any per-conversion options, and a digest of the
+content. Changing a template or its options changes that route's keys,
+so entries for several configurations stay warm side by side and old
+ones simply age out, instead of every change needing /clear-cache.
+"""
+import json
+
+import hashing
+
+# Layout of the keys themselves, bump when it changes
+KEY_FORMAT = 'v2'
+
+
+def content_digest(content):
+    """Hex digest of bytes, or of a string encoded as UTF-8 (see hashing for the algorithm)"""
+    return hashing.digest(content)
+
+
+def template_version(*parts):
+    """
+    Get a short version string for everything that shapes a route's output besides
+    the content: template HTML, renderer options, engine version.
+
+    Args:
+        parts: JSON serializable values (anything else is serialized with str())
+
+    Returns:
+        str: 16 hex characters, changing whenever any of the parts changes
+    """
+    return hashing.digest(json.dumps(parts, sort_keys=True, default=str))[:16]
+
+
+def cache_key(route, version, digest, **options):
+    """
+    Build a structured cache key.
+
+    Args:
+        route: Conversion route, e.g. 'chromium-html' or 'libreoffice'
+        version: Template/engine version of the route (see template_version)
+        digest: Digest of the converted content
+        options: Per-conversion options that change the output
+
+    Returns:
+        str: The key, e.g. 'v2|libreoffice|3f9c0e1d2b4a5c6e|ext=.docx|<digest>'
+    """
+    option_text = ','.join(f"{name}={value}" for name, value in sorted(options.items()))
+    return f"{KEY_FORMAT}|{route}|{version}|{option_text}|{digest}"
@@ -0,0 +1,163 @@
+"""
+File format tables for the PDF server.
+Extension and MIME type lookups, the patterns used to pick apart inline
+images, and content type sniffing live here as module-level constants,
+built once at import instead of on every conversion call. Content types
+are sniffed from magic bytes first and the filename extension second.
+"""
+import os
+import re
+from types import MappingProxyType
+
+# Base64 data: URL as used for inline images
+DATA_URL_PATTERN = re.compile(r'data:([^;]+);base64,(.+)', re.DOTALL)
+
+# Extensions that are safe to reuse for files sent to Gotenberg
+SAFE_EXTENSION_PATTERN = re.compile(r'\.[a-z0-9]{1,5}')
+
+# Image types we can convert directly to PDF, by extension
+IMAGE_MIME_TYPES = MappingProxyType({
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.bmp': 'image/bmp',
+    '.webp': 'image/webp',
+})
+IMAGE_EXTENSIONS = frozenset(IMAGE_MIME_TYPES)
+
+# File extension for an image MIME type
+IMAGE_EXTENSIONS_BY_MIME_TYPE = MappingProxyType({
+    'image/jpeg': '.jpg',
+    'image/jpg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/bmp': '.bmp',
+    'image/webp': '.webp',
+})
+
+# Fallback for images whose type can't be determined
+DEFAULT_IMAGE_MIME_TYPE = 'image/jpeg'
+
+# File types that LibreOffice can convert, by extension
+OFFICE_MIME_TYPES = MappingProxyType({
+    # Word documents
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.doc': 'application/msword',
+    '.odt': 'application/vnd.oasis.opendocument.text',
+    '.rtf': 'application/rtf',
+    # Excel spreadsheets
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.xls': 'application/vnd.ms-excel',
+    '.ods': 'application/vnd.oasis.opendocument.spreadsheet',
+    # PowerPoint presentations
+    '.pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    '.ppt': 'application/vnd.ms-powerpoint',
+    '.odp': 'application/vnd.oasis.opendocument.presentation',
+    # Text files
+    '.txt': 'text/plain',
+    '.csv': 'text/csv',
+    # HTML files
+    '.html': 'text/html',
+    '.htm': 'text/html',
+})
+OFFICE_EXTENSIONS = frozenset(OFFICE_MIME_TYPES)
+
+# Every extension we know a content type for
+MIME_TYPES = MappingProxyType({**IMAGE_MIME_TYPES, **OFFICE_MIME_TYPES, '.pdf': 'application/pdf'})
+
+# Leading bytes of the formats we recognize, checked in order
+MAGIC_NUMBERS = (
+    (b'%PDF-', 'application/pdf'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'{\\rtf', 'application/rtf'),
+    (b'PK\x03\x04', 'application/zip'),                         # docx/xlsx/pptx/odt/... containers
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/x-ole-storage'),  # doc/xls/ppt
+)
+
+# Bytes needed to sniff any of the formats above
+SNIFF_BYTES = 16
+
+# Signatures shared by several office formats, the extension tells them apart
+OFFICE_CONTAINER_TYPES = frozenset({'application/zip', 'application/x-ole-storage', 'application/rtf'})
+
+# Byte order marks of text files (UTF-16 text contains NUL bytes)
+TEXT_BOMS = (b'\xef\xbb\xbf', b'\xff\xfe', b'\xfe\xff')
+
+
+def file_extension(filename):
+    """Lowercase extension of a filename, including the dot ('' if none)"""
+    return os.path.splitext(filename or '')[1].lower()
+
+
+def sniff_magic(head):
+    """
+    Get the content type from the leading bytes of a file.
+
+    Args:
+        head: The first bytes of the file (at least SNIFF_BYTES for a reliable match)
+
+    Returns:
+        str: The MIME type, or None if the bytes don't match a known format
+    """
+    if not head:
+        return None
+    for magic, mime_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return mime_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:2] == b'BM' and head[6:10] == b'\0\0\0\0':
+        # 'BM' alone is too short a signature, BMP headers have 4 reserved zero bytes after the file size
+        return 'image/bmp'
+    return None
+
+
+def looks_like_text(head):
+    """Check whether the leading bytes of a file with no known signature look like text rather than binary"""
+    return head.startswith(TEXT_BOMS) or b'\0' not in head
+
+
+def sniff_content_type(head, filename=None, default='application/octet-stream'):
+    """
+    Get a file's content type, from its magic bytes first and its extension second.
+    Office documents are zip/OLE containers, so for those the extension picks the
+    specific type when it agrees with the container.
+
+    Args:
+        head: The first bytes of the file, or None if not available
+        filename: The filename, for the extension lookup
+        default: Returned when neither the bytes nor the extension are recognized
+
+    Returns:
+        str: The MIME type
+    """
+    by_extension = MIME_TYPES.get(file_extension(filename))
+    by_magic = sniff_magic(head)
+    if by_magic in OFFICE_CONTAINER_TYPES and by_extension in OFFICE_MIME_TYPES.values():
+        return by_extension
+    return by_magic or by_extension or default
+
+
+def image_mime_type(mime_type, filename, head=None):
+    """
+    Get the MIME type to use for an image: the reported one if it is an image type,
+    otherwise sniffed from the image bytes or the filename, defaulting to JPEG.
+    """
+    if mime_type and mime_type.startswith('image/'):
+        return mime_type
+    sniffed = sniff_content_type(head, filename, DEFAULT_IMAGE_MIME_TYPE)
+    return sniffed if sniffed.startswith('image/') else DEFAULT_IMAGE_MIME_TYPE
+
+
+def image_extension(mime_type, default='.jpg'):
+    """Get the file extension for an image MIME type"""
+    return IMAGE_EXTENSIONS_BY_MIME_TYPE.get(mime_type, default)
+
+
+def is_image_file(filename, content_type):
+    """Check whether a file looks like an image by content type or extension"""
+    return (content_type or '').startswith('image/') or file_extension(filename) in IMAGE_EXTENSIONS
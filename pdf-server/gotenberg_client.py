@@ -0,0 +1,302 @@
+"""
+Gotenberg client module for the PDF server.
+Provides pooled, keep-alive HTTP clients shared by all conversion paths:
+a thread-safe client for the request threads and an asyncio client for the
+async conversion pipeline.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Gotenberg routes used by the server
+ROUTES = {
+    'chromium_html': '/forms/chromium/convert/html',
+    'libreoffice': '/forms/libreoffice/convert',
+    'merge': '/forms/pdfengines/merge',
+    'health': '/health',
+}
+
+# Default per-route timeouts in seconds
+DEFAULT_TIMEOUTS = {
+    'chromium_html': 30,
+    'libreoffice': 25,
+    'merge': 30,
+    'health': 3,
+}
+
+# Status codes Gotenberg returns when it is busy (queue full / service unavailable)
+RETRY_STATUSES = frozenset({429, 503})
+
+
+class BaseGotenbergClient:
+    """
+    Settings and request statistics shared by the sync and async clients.
+    """
+
+    def __init__(self, base_url, pool_size=10, timeouts=None, max_retries=2, backoff_factor=0.5):
+        """
+        Initialize the Gotenberg client.
+
+        Args:
+            base_url: Base URL of the Gotenberg service
+            pool_size: Maximum number of pooled keep-alive connections
+            timeouts: Per-route timeout overrides in seconds (see DEFAULT_TIMEOUTS)
+            max_retries: Number of retries on 429/503 responses
+            backoff_factor: Base delay in seconds for exponential backoff
+        """
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+        self.lock = threading.Lock()
+        self.requests_sent = 0
+        self.retries = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.route_counts = {}
+
+    def _url(self, route):
+        return f"{self.base_url}{ROUTES[route]}"
+
+    def _timeout(self, route, timeout):
+        return timeout if timeout is not None else self.timeouts.get(route, 30)
+
+    def _backoff_delay(self, attempt, response):
+        """Get the delay before the next retry, honoring Retry-After if present"""
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return min(float(retry_after), 10.0)
+            except ValueError:
+                pass
+        return self.backoff_factor * (2 ** attempt)
+
+    def _record(self, route, elapsed, error=False):
+        with self.lock:
+            self.requests_sent += 1
+            self.total_time += elapsed
+            if error:
+                self.errors += 1
+            else:
+                self.route_counts[route] = self.route_counts.get(route, 0) + 1
+
+    def _should_retry(self, route, response, attempt):
+        """Check whether a busy response should be retried, returns the delay or None"""
+        if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+            return None
+        delay = self._backoff_delay(attempt, response)
+        logger.warning(f"Gotenberg busy ({response.status_code}) on {route}, retrying in {delay:.2f}s")
+        with self.lock:
+            self.retries += 1
+        return delay
+
+    def _request_stats(self):
+        with self.lock:
+            avg_time = (self.total_time / self.requests_sent) if self.requests_sent else 0
+            return {
+                'pool_size': self.pool_size,
+                'requests': self.requests_sent,
+                'retries': self.retries,
+                'errors': self.errors,
+                'avg_request_time': f"{avg_time:.3f}s",
+                'routes': dict(self.route_counts),
+                'timeouts': dict(self.timeouts)
+            }
+
+
+class GotenbergClient(BaseGotenbergClient):
+    """
+    Thread-safe Gotenberg client backed by a keep-alive connection pool.
+    Retries busy responses (429/503) with exponential backoff and keeps
+    request and pool statistics for monitoring.
+    """
+
+    def __init__(self, base_url, pool_size=10, timeouts=None, max_retries=2, backoff_factor=0.5):
+        super().__init__(base_url, pool_size, timeouts, max_retries, backoff_factor)
+
+        self.session = requests.Session()
+        # Retries are handled in _request so they can be counted and honor Retry-After
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False, max_retries=0)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+    def _request(self, method, route, timeout=None, **kwargs):
+        """Send a request to a Gotenberg route, retrying on 429/503"""
+        url = self._url(route)
+        timeout = self._timeout(route, timeout)
+        attempt = 0
+
+        while True:
+            start_time = time.time()
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.RequestException:
+                self._record(route, time.time() - start_time, error=True)
+                raise
+            self._record(route, time.time() - start_time)
+
+            delay = self._should_retry(route, response, attempt)
+            if delay is None:
+                return response
+            response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def post(self, route, files=None, data=None, timeout=None, stream=False):
+        """
+        POST a multipart form to a Gotenberg route.
+
+        Args:
+            route: Route name (key of ROUTES)
+            files: Files for the multipart form
+            data: Form fields
+            timeout: Optional timeout override in seconds
+            stream: Don't read the response body up front (read it with iter_content)
+
+        Returns:
+            requests.Response: The Gotenberg response
+        """
+        return self._request('POST', route, timeout=timeout, files=files, data=data, stream=stream)
+
+    def health(self, timeout=None):
+        """Check Gotenberg health, returns True if the service is up"""
+        try:
+            response = self._request('GET', 'health', timeout=timeout)
+            return response.status_code == 200
+        except requests.RequestException:
+            return False
+
+    def warm_up(self, connections=2):
+        """
+        Open keep-alive connections to Gotenberg ahead of the first request.
+
+        Args:
+            connections: Number of connections to open concurrently
+
+        Returns:
+            bool: True if Gotenberg answered on every connection
+        """
+        connections = max(1, min(connections, self.pool_size))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=connections) as executor:
+            results = list(executor.map(lambda _: self.health(), range(connections)))
+        return all(results)
+
+    def get_stats(self):
+        """Get client and connection pool statistics"""
+        connections_opened = 0
+        pooled_requests = 0
+        idle_connections = 0
+        for pool_key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(pool_key)
+            if pool is None:
+                continue
+            connections_opened += pool.num_connections
+            pooled_requests += pool.num_requests
+            if pool.pool is not None:
+                idle_connections += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+
+        stats = self._request_stats()
+        stats.update({
+            'connections_opened': connections_opened,
+            'connections_idle': idle_connections,
+            'connection_reuse': pooled_requests - connections_opened if pooled_requests else 0,
+        })
+        return stats
+
+    def close(self):
+        """Close all pooled connections"""
+        self.session.close()
+
+
+class AsyncGotenbergClient(BaseGotenbergClient):
+    """
+    asyncio Gotenberg client backed by an httpx keep-alive connection pool.
+    Many conversions can be in flight on one event loop, bounded by the pool
+    size, instead of each holding a thread while Gotenberg renders. The
+    underlying httpx client is bound to the event loop it is first used on.
+    """
+
+    def __init__(self, base_url, pool_size=10, timeouts=None, max_retries=2, backoff_factor=0.5):
+        super().__init__(base_url, pool_size, timeouts, max_retries, backoff_factor)
+        if not HTTPX_AVAILABLE:
+            raise ImportError("httpx is required for the async Gotenberg client")
+        self.client = None
+
+    def _client(self):
+        # Created lazily so it belongs to the running event loop
+        if self.client is None:
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            self.client = httpx.AsyncClient(limits=limits)
+        return self.client
+
+    async def _request(self, method, route, timeout=None, **kwargs):
+        """Send a request to a Gotenberg route, retrying on 429/503"""
+        url = self._url(route)
+        timeout = self._timeout(route, timeout)
+        attempt = 0
+
+        while True:
+            start_time = time.time()
+            try:
+                response = await self._client().request(method, url, timeout=timeout, **kwargs)
+            except httpx.HTTPError:
+                self._record(route, time.time() - start_time, error=True)
+                raise
+            self._record(route, time.time() - start_time)
+
+            delay = self._should_retry(route, response, attempt)
+            if delay is None:
+                return response
+            await response.aclose()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def post(self, route, files=None, data=None, timeout=None):
+        """
+        POST a multipart form to a Gotenberg route.
+
+        Args:
+            route: Route name (key of ROUTES)
+            files: Files for the multipart form
+            data: Form fields
+            timeout: Optional timeout override in seconds
+
+        Returns:
+            httpx.Response: The Gotenberg response
+        """
+        return await self._request('POST', route, timeout=timeout, files=files, data=data)
+
+    async def health(self, timeout=None):
+        """Check Gotenberg health, returns True if the service is up"""
+        try:
+            response = await self._request('GET', 'health', timeout=timeout)
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    def get_stats(self):
+        """Get client statistics"""
+        return self._request_stats()
+
+    async def aclose(self):
+        """Close all pooled connections"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
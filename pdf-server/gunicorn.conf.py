@@ -0,0 +1,32 @@
+"""
+Gunicorn configuration for the PDF server.
+Runs the Flask app with multiple worker processes and threads, configured
+from the same environment variables as docker-compose.yml.
+"""
+import os
+
+# Listen on the configured port
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Worker processes, each with a pool of request threads
+workers = int(os.environ.get('WORKERS', '4'))
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', '8'))
+
+# Conversions can take up to ~30s per Gotenberg call, plus retries and merging
+timeout = int(os.environ.get('TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+
+# Don't preload: every worker opens its own Gotenberg connections and cache journal handle
+preload_app = False
+
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
+errorlog = '-'
+accesslog = '-' if loglevel == 'debug' else None
+
+
+def post_worker_init(worker):
+    """Warm up the Gotenberg connection pool before the worker takes requests"""
+    from app import warm_up
+    warm_up()
@@ -0,0 +1,88 @@
+"""
+Content hashing module for the PDF server.
+Cache keys and duplicate detection need a fast digest with negligible
+collision risk, not a signature, so the fastest available algorithm is
+used: BLAKE3 (blake3 package), then XXH3-128 (xxhash package), then
+SHA-256 from hashlib, which OpenSSL runs on the SHA extensions of current
+CPUs (about twice as fast as BLAKE2b there). CONTENT_HASH overrides the
+choice. Bytes are hashed through a memoryview without copying, strings
+and streams in chunks, so a large attachment is never duplicated in memory
+just to hash it.
+"""
+import hashlib
+import logging
+import os
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+logger = logging.getLogger(__name__)
+
+# Chunk size for hashing strings and streams
+CHUNK_SIZE = 1024 * 1024
+
+# Hash constructors by name, in order of preference (only the installed ones)
+HASHERS = {}
+if blake3 is not None:
+    HASHERS['blake3'] = blake3.blake3
+if xxhash is not None:
+    HASHERS['xxh3_128'] = xxhash.xxh3_128
+HASHERS['sha256'] = hashlib.sha256
+HASHERS['blake2b'] = lambda: hashlib.blake2b(digest_size=32)
+
+
+def _select_hasher():
+    """Get (name, constructor) of the hash to use: CONTENT_HASH if installed, else the fastest one"""
+    requested = os.environ.get('CONTENT_HASH', '').lower()
+    if requested and requested not in HASHERS:
+        logger.warning(f"Content hash {requested} is not available, using {next(iter(HASHERS))}")
+    name = requested if requested in HASHERS else next(iter(HASHERS))
+    return name, HASHERS[name]
+
+
+HASH_NAME, _new_hasher = _select_hasher()
+
+
+def new_hasher():
+    """Create an incremental hasher (update/digest/hexdigest) of the selected algorithm"""
+    return _new_hasher()
+
+
+def update(hasher, content):
+    """
+    Feed content to a hasher.
+
+    Args:
+        hasher: A hasher from new_hasher()
+        content: bytes, bytearray, memoryview or str (hashed as UTF-8)
+
+    Returns:
+        The hasher
+    """
+    if isinstance(content, str):
+        # Encode in chunks so a large base64 string isn't copied whole
+        for start in range(0, len(content), CHUNK_SIZE):
+            hasher.update(content[start:start + CHUNK_SIZE].encode('utf-8'))
+    else:
+        hasher.update(memoryview(content))
+    return hasher
+
+
+def digest(content):
+    """Hex digest of bytes-like content or a string (UTF-8)"""
+    return update(_new_hasher(), content).hexdigest()
+
+
+def stream_digest(stream):
+    """Hex digest of a binary file object from its current position to the end, read in chunks"""
+    hasher = _new_hasher()
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+        hasher.update(chunk)
+    return hasher.hexdigest()
@@ -0,0 +1,191 @@
+"""
+HTML scanning module for the PDF server.
+Tokenizes the email HTML once with html.parser and keeps the image
+references the conversion steps need: every <img> src (data: URLs, cid:
+references and external URLs) and every cid: attribute value, with its
+position in the source. Image extraction, embedded-image detection and
+CID resolution all read this model instead of each running a regex over
+the whole HTML, and tags inside comments, <script> or <style> are not
+mistaken for images.
+"""
+import html
+import logging
+import re
+from html.parser import HTMLParser
+
+import hashing
+from formats import DATA_URL_PATTERN
+
+logger = logging.getLogger(__name__)
+
+# Tag name and attributes inside a start tag, tokenized the way html.parser does
+TAG_NAME_PATTERN = re.compile(r'<[a-zA-Z][^\t\n\r\f />\x00]*(?:\s|/(?!>))*')
+ATTRIBUTE_PATTERN = re.compile(r'''([^\s/>][^\s/=>]*)(?:\s*=+\s*('[^']*'|"[^"]*"|(?!['"])[^>\s]*))?(?:\s|/(?!>))*''')
+
+
+class ImageSource:
+    """
+    An image reference in the HTML: an attribute value and the span of the
+    value (including its quotes) in the HTML source.
+    """
+
+    __slots__ = ('tag', 'attribute', 'value', 'start', 'end')
+
+    def __init__(self, tag, attribute, value, start, end):
+        self.tag = tag
+        self.attribute = attribute
+        self.value = value
+        self.start = start
+        self.end = end
+
+    @property
+    def is_image(self):
+        """Whether this is the src of an <img> tag"""
+        return self.tag == 'img' and self.attribute == 'src'
+
+    @property
+    def cid(self):
+        """The Content-ID referenced by a cid: URL, or None"""
+        if self.value[:4].lower() == 'cid:':
+            return self.value[4:]
+        return None
+
+    def data_url(self):
+        """
+        Split a base64 data: URL.
+
+        Returns:
+            tuple: (mime_type, base64_data), or None if the value isn't a base64 data: URL
+        """
+        match = DATA_URL_PATTERN.match(self.value)
+        return (match.group(1), match.group(2)) if match else None
+
+    def moved(self, offset, value=None, length=None):
+        """Copy of this reference shifted by offset, optionally with a new value spanning length characters"""
+        if value is None:
+            return ImageSource(self.tag, self.attribute, self.value, self.start + offset, self.end + offset)
+        return ImageSource(self.tag, self.attribute, value, self.start + offset, self.start + offset + length)
+
+
+class _ImageScanner(HTMLParser):
+    """Collects ImageSource entries while html.parser tokenizes the document"""
+
+    def __init__(self, html_content):
+        super().__init__(convert_charrefs=True)
+        # Offset of each line start, to turn getpos() into an index into the HTML
+        self.line_starts = [0] + [match.end() for match in re.finditer('\n', html_content)]
+        self.sources = []
+
+    def handle_starttag(self, tag, attrs):
+        # Only tags with an image or cid: reference need their attribute spans located
+        if not any(value and (tag == 'img' and name == 'src' or value[:4].lower() == 'cid:')
+                   for name, value in attrs):
+            return
+
+        line, column = self.getpos()
+        tag_start = self.line_starts[line - 1] + column
+        tag_text = self.get_starttag_text()
+
+        position = TAG_NAME_PATTERN.match(tag_text).end()
+        while position < len(tag_text):
+            match = ATTRIBUTE_PATTERN.match(tag_text, position)
+            if not match or match.end() == position:
+                break
+            position = match.end()
+
+            name, raw_value = match.group(1).lower(), match.group(2)
+            if not raw_value:
+                continue
+            if raw_value[0] in '"\'':
+                value = html.unescape(raw_value[1:-1])
+            else:
+                value = html.unescape(raw_value)
+
+            if (tag == 'img' and name == 'src') or value[:4].lower() == 'cid:':
+                start = tag_start + match.start(2)
+                self.sources.append(ImageSource(tag, name, value, start, start + len(raw_value)))
+
+
+class HtmlDocument:
+    """
+    The email HTML with its image references, in document order.
+    """
+
+    def __init__(self, html_content, sources, digest=None):
+        """
+        Initialize the document, use HtmlDocument.parse to scan HTML.
+
+        Args:
+            html_content: The HTML source
+            sources: ImageSource entries found in the source, in document order
+            digest: hashing.digest of html_content if the caller already has it
+        """
+        self.html = html_content
+        self.sources = sources
+        self._digest = digest
+
+    @classmethod
+    def parse(cls, html_content, digest=None):
+        """Tokenize the HTML once and collect its image references"""
+        scanner = _ImageScanner(html_content)
+        try:
+            scanner.feed(html_content)
+            scanner.close()
+        except Exception as e:
+            logger.warning(f"Error scanning HTML for images: {str(e)}")
+        return cls(html_content, scanner.sources, digest)
+
+    @property
+    def digest(self):
+        """Digest of the HTML source (hashing.digest), computed once"""
+        if self._digest is None:
+            self._digest = hashing.digest(self.html)
+        return self._digest
+
+    @property
+    def images(self):
+        """The src of every <img> tag"""
+        return [source for source in self.sources if source.is_image]
+
+    @property
+    def cid_references(self):
+        """Every Content-ID referenced from an attribute (img src, background, ...), in document order"""
+        return [source.cid for source in self.sources if source.cid is not None]
+
+    def replace(self, replacements):
+        """
+        Rewrite attribute values in a single pass.
+
+        Args:
+            replacements: dict of {ImageSource from this document: new value}
+
+        Returns:
+            HtmlDocument: The rewritten document, with its references moved to match
+        """
+        if not replacements:
+            return self
+
+        parts = []
+        sources = []
+        position = 0
+        offset = 0
+        for source in self.sources:
+            if source not in replacements:
+                sources.append(source.moved(offset))
+                continue
+
+            # Keep the original quote character, bare values get double quotes
+            quote = self.html[source.start] if self.html[source.start] in '"\'' else '"'
+            value = replacements[source]
+            if '&' in value or quote in value:
+                quoted = f"{quote}{html.escape(value)}{quote}"
+            else:
+                quoted = f"{quote}{value}{quote}"
+            parts.append(self.html[position:source.start])
+            parts.append(quoted)
+            position = source.end
+            sources.append(source.moved(offset, value, len(quoted)))
+            offset += len(quoted) - (source.end - source.start)
+
+        parts.append(self.html[position:])
+        return HtmlDocument(''.join(parts), sources)
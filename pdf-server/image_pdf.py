@@ -0,0 +1,155 @@
+"""
+Local image-to-PDF engine for the PDF server.
+Writes a one-page PDF around an image in-process, instead of sending the
+image to Gotenberg's Chromium route just to place one picture on a page.
+JPEGs are embedded as-is (DCTDecode), other formats are decoded with
+Pillow and embedded losslessly (FlateDecode).
+"""
+import io
+import logging
+import zlib
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Formats the engine handles, anything else falls back to Gotenberg
+SUPPORTED_FORMATS = frozenset({'JPEG', 'PNG', 'GIF', 'BMP', 'WEBP'})
+
+# Letter paper with 0.5in margins, same layout as the Gotenberg image page (in points)
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+MARGIN = 36
+
+# Image pixels are CSS pixels on the Chromium route: 96 per inch, 72 points per inch
+POINTS_PER_PIXEL = 0.75
+
+# EXIF orientation tag
+ORIENTATION_TAG = 0x0112
+
+# JPEG color modes that can be passed through, with their PDF color space
+JPEG_COLOR_SPACES = {
+    'L': '/DeviceGray',
+    'RGB': '/DeviceRGB',
+    'CMYK': '/DeviceCMYK',
+}
+
+
+def _placement_matrix(orientation, x, y, width, height):
+    """
+    Get the PDF matrix (a b c d e f) that draws the image unit square into the
+    box (x, y, width, height), applying the EXIF orientation.
+    """
+    return {
+        1: (width, 0, 0, height, x, y),
+        2: (-width, 0, 0, height, x + width, y),                   # Mirrored horizontally
+        3: (-width, 0, 0, -height, x + width, y + height),         # Rotated 180
+        4: (width, 0, 0, -height, x, y + height),                  # Mirrored vertically
+        5: (0, -height, -width, 0, x + width, y + height),         # Transposed
+        6: (0, -height, width, 0, x, y + height),                  # Rotated 90 CW
+        7: (0, height, width, 0, x, y),                            # Transversed
+        8: (0, height, -width, 0, x + width, y),                   # Rotated 90 CCW
+    }.get(orientation, (width, 0, 0, height, x, y))
+
+
+def _image_stream(image, image_bytes):
+    """
+    Get the image XObject dictionary entries and stream data.
+
+    Returns:
+        tuple: (dictionary entries, stream bytes)
+    """
+    width, height = image.size
+
+    if image.format == 'JPEG' and image.mode in JPEG_COLOR_SPACES:
+        # Embed the JPEG bytes unchanged
+        entries = f"/Width {width} /Height {height} /ColorSpace {JPEG_COLOR_SPACES[image.mode]} /BitsPerComponent 8 /Filter /DCTDecode"
+        if image.mode == 'CMYK' and 'adobe' in image.info:
+            # Adobe CMYK JPEGs store inverted values
+            entries += " /Decode [1 0 1 0 1 0 1 0]"
+        return entries, image_bytes
+
+    # First frame only for animated GIF/WebP
+    image.seek(0)
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        # Flatten transparency onto the white page, as Chromium renders it
+        rgba = image.convert('RGBA')
+        image = Image.new('RGB', rgba.size, (255, 255, 255))
+        image.paste(rgba, mask=rgba.getchannel('A'))
+    elif image.mode == '1':
+        image = image.convert('L')
+    elif image.mode != 'L':
+        image = image.convert('RGB')
+
+    color_space = '/DeviceGray' if image.mode == 'L' else '/DeviceRGB'
+    entries = f"/Width {width} /Height {height} /ColorSpace {color_space} /BitsPerComponent 8 /Filter /FlateDecode"
+    return entries, zlib.compress(image.tobytes(), 6)
+
+
+def _write_pdf(image_entries, image_data, content):
+    """Write a one-page PDF drawing a single image XObject"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+         f"/Resources << /XObject << /Im0 4 0 R >> >> /Contents 5 0 R >>").encode('ascii'),
+        f"<< /Type /XObject /Subtype /Image {image_entries} /Length {len(image_data)} >>\nstream\n".encode('ascii')
+        + image_data + b"\nendstream",
+        f"<< /Length {len(content)} >>\nstream\n".encode('ascii') + content + b"\nendstream",
+    ]
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(output.tell())
+        output.write(f"{number} 0 obj\n".encode('ascii'))
+        output.write(body)
+        output.write(b"\nendobj\n")
+
+    xref_offset = output.tell()
+    output.write(f"xref\n0 {len(objects) + 1}\n".encode('ascii'))
+    output.write(b"0000000000 65535 f \n")
+    for offset in offsets:
+        output.write(f"{offset:010d} 00000 n \n".encode('ascii'))
+    output.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode('ascii'))
+    return output.getvalue()
+
+
+def image_to_pdf(image_bytes):
+    """
+    Convert an image to a one-page Letter PDF, scaled down to fit the margins and centered.
+
+    Args:
+        image_bytes: Raw image file content
+
+    Returns:
+        bytes: The PDF, or None if the image format isn't supported or can't be decoded
+    """
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        if image.format not in SUPPORTED_FORMATS:
+            logger.info(f"Image format {image.format} not supported by the local engine")
+            return None
+
+        orientation = image.getexif().get(ORIENTATION_TAG, 1)
+        width, height = image.size
+        if orientation in (5, 6, 7, 8):
+            width, height = height, width
+
+        # Fit to the printable area without upscaling, centered on the page
+        scale = min(POINTS_PER_PIXEL,
+                    (PAGE_WIDTH - 2 * MARGIN) / width,
+                    (PAGE_HEIGHT - 2 * MARGIN) / height)
+        box_width, box_height = width * scale, height * scale
+        x = (PAGE_WIDTH - box_width) / 2
+        y = (PAGE_HEIGHT - box_height) / 2
+
+        image_entries, image_data = _image_stream(image, image_bytes)
+        matrix = ' '.join(f"{value:.4f}" for value in _placement_matrix(orientation, x, y, box_width, box_height))
+        content = f"q {matrix} cm /Im0 Do Q".encode('ascii')
+        return _write_pdf(image_entries, image_data, content)
+
+    except Exception as e:
+        logger.warning(f"Local image-to-PDF conversion failed: {str(e)}")
+        return None
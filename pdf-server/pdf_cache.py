@@ -2,234 +2,586 @@
 PDF caching module for the PDF server.
 Provides a simple caching mechanism to avoid redundant conversions.
 """
-import hashlib
 import time
 import logging
 import threading
 import os
-import pickle
+import shutil
+from collections import OrderedDict, defaultdict
 from pathlib import Path
 
+import hashing
+from cache_journal import CacheJournal
+
 logger = logging.getLogger(__name__)
 
+# Minimum seconds between rescans of a shared cache directory (see _sync_with_directory)
+DIRECTORY_SYNC_INTERVAL = 1.0
+
+
+class _CacheEntry:
+    """Index entry for a cached PDF"""
+    __slots__ = ('timestamp', 'size', 'content')
+
+    def __init__(self, timestamp, size, content=None):
+        self.timestamp = timestamp  # Last access time
+        self.size = size            # PDF size in bytes
+        self.content = content      # PDF bytes (in-memory cache only)
+
+
+class _CacheShard:
+    """One lock stripe of the cache index"""
+
+    def __init__(self):
+        self.cache = OrderedDict()  # LRU index: {hash: _CacheEntry}, least recently used first
+        self.lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def pop(self, key):
+        """Remove an entry from the index, caller must hold the lock"""
+        entry = self.cache.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+        return entry
+
+    def oldest_timestamp(self):
+        """Timestamp of the least recently used entry, or None if empty"""
+        with self.lock:
+            for entry in self.cache.values():
+                return entry.timestamp
+        return None
+
+
 class PdfCache:
     """
     Cache for converted PDFs to avoid redundant conversions.
     Uses content hashing to identify identical documents.
+
+    Entries are kept in LRU ordered dicts bounded by both entry count and
+    total bytes. Since every access moves an entry to the end and refreshes
+    its timestamp, the front of each dict is always the least recently used
+    and the first to expire, so eviction and TTL expiry are O(1) amortized.
+
+    The index is split into lock stripes (shards) selected by hash. Locks
+    only guard in-memory index updates; cached PDF files are read and
+    written outside any lock, and the index is updated once the blob I/O
+    has finished.
+
+    Worker processes can share one cache directory. The byte and entry
+    budgets then apply to the whole directory: before evicting, each
+    process rescans the directory so its index counts the PDFs cached by
+    the others, and a cache hit refreshes the file's mtime so every
+    process sees the same least recently used order.
     """
-    
-    def __init__(self, cache_dir=None, max_entries=100, ttl=3600):
+
+    def __init__(self, cache_dir=None, max_entries=100, ttl=3600, max_bytes=64 * 1024 * 1024,
+                 max_entry_bytes=None, shards=16):
         """
         Initialize the PDF cache.
-        
+
         Args:
             cache_dir: Directory to store cached PDFs. If None, uses in-memory cache.
             max_entries: Maximum number of entries in the cache
             ttl: Time-to-live for cache entries in seconds (default: 1 hour)
+            max_bytes: Maximum total size of cached PDFs in bytes (default: 64 MB)
+            max_entry_bytes: Largest PDF admitted to the cache (default: max_bytes / 4)
+            shards: Number of lock stripes for the cache index
         """
-        self.cache = {}  # In-memory cache: {hash: (timestamp, pdf_content)}
+        self.shards = [_CacheShard() for _ in range(max(1, shards))]
         self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 4
         self.ttl = ttl
-        self.lock = threading.RLock()
-        self.hits = 0
-        self.misses = 0
+        # Serializes eviction only; never held during disk I/O
+        self.evict_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+        self.rejections = 0
         self.cache_dir = cache_dir
-        
+        self.journal = None
+        self.sync_lock = threading.Lock()
+        self.last_sync = 0
+
         if cache_dir:
             # Create cache directory if it doesn't exist
             os.makedirs(cache_dir, exist_ok=True)
-            
-            # Load existing cache from disk if available
+
+            # Recover the index from the journal and the cache directory
+            self.journal = CacheJournal(Path(cache_dir) / "cache_index.journal")
             self._load_cache_index()
-    
+
+    def _shard(self, content_hash):
+        """Get the lock stripe for a hash"""
+        return self.shards[int(content_hash[:8], 16) % len(self.shards)]
+
     def _load_cache_index(self):
-        """Load cache index from disk if available"""
-        index_path = Path(self.cache_dir) / "cache_index.pkl"
-        if index_path.exists():
+        """
+        Rebuild the cache index on startup.
+
+        The journal supplies access order and timestamps; the cache directory
+        is authoritative for which PDFs exist. Blobs without a journal entry
+        are adopted, journal entries without a blob are dropped, and stale
+        temporary files from interrupted writes are removed.
+        """
+        cache_path = Path(self.cache_dir)
+        journal_index = self.journal.replay()
+
+        # Older versions pickled the whole index on every put
+        legacy_index_path = cache_path / "cache_index.pkl"
+        if legacy_index_path.exists():
             try:
-                with open(index_path, 'rb') as f:
-                    self.cache = pickle.load(f)
-                logger.info(f"Loaded PDF cache index with {len(self.cache)} entries")
-            except Exception as e:
-                logger.error(f"Failed to load cache index: {str(e)}")
-                self.cache = {}
-    
-    def _save_cache_index(self):
-        """Save cache index to disk"""
-        if self.cache_dir:
-            index_path = Path(self.cache_dir) / "cache_index.pkl"
+                legacy_index_path.unlink()
+            except OSError as e:
+                logger.warning(f"Failed to remove legacy cache index: {str(e)}")
+
+        index = {}
+        for key, (mtime, size) in self._scan_blobs().items():
+            timestamp, _ = journal_index.get(key, (mtime, None))
+            index[key] = (timestamp, size)
+
+        # Insert oldest first so the ordered dicts match LRU order
+        for key, (timestamp, size) in sorted(index.items(), key=lambda item: item[1][0]):
+            shard = self._shard(key)
+            shard.cache[key] = _CacheEntry(timestamp, size)
+            shard.total_bytes += size
+
+        for shard in self.shards:
+            self._delete_blobs(self._expire(shard))
+        self._delete_blobs(self._evict())
+        self._compact_journal()
+        logger.info(f"Loaded PDF cache index with {self._entry_count()} entries ({self._total_bytes()} bytes)")
+
+    def _scan_blobs(self):
+        """
+        List the PDFs in the cache directory and remove stale temporary files.
+
+        Returns:
+            dict: key -> (mtime, size) for every cached PDF
+        """
+        blobs = {}
+        for path in Path(self.cache_dir).iterdir():
+            name = path.name
+            if name.endswith('.tmp'):
+                # Leftover from an interrupted write; recent ones may belong to another live worker
+                try:
+                    if time.time() - path.stat().st_mtime > 300:
+                        path.unlink()
+                except OSError:
+                    pass
+                continue
+            if not name.endswith('.pdf'):
+                continue
+
+            key = name[:-len('.pdf')]
+            try:
+                int(key[:8], 16)
+                stat = path.stat()
+            except (ValueError, OSError):
+                continue
+            blobs[key] = (stat.st_mtime, stat.st_size)
+        return blobs
+
+    def _sync_with_directory(self):
+        """
+        Bring the index in line with a cache directory shared with other workers.
+
+        PDFs cached by other processes are counted, PDFs they evicted are
+        dropped, and entries are reordered by the later of their own access
+        time and the file's mtime, so that eviction enforces the budget for
+        the whole directory. Rescans at most once per DIRECTORY_SYNC_INTERVAL.
+        """
+        with self.sync_lock:
+            scan_started = time.time()
+            if scan_started - self.last_sync < DIRECTORY_SYNC_INTERVAL:
+                return
+            self.last_sync = scan_started
+
+        # Scan outside the shard locks, it touches every file
+        by_shard = defaultdict(dict)
+        for key, blob in self._scan_blobs().items():
+            by_shard[id(self._shard(key))][key] = blob
+
+        for shard in self.shards:
+            on_disk = by_shard.get(id(shard), {})
+            with shard.lock:
+                entries = {}
+                for key, entry in shard.cache.items():
+                    if key in on_disk:
+                        mtime, entry.size = on_disk[key]
+                        entry.timestamp = max(entry.timestamp, mtime)
+                        entries[key] = entry
+                    elif entry.timestamp >= scan_started:
+                        # Stored while the directory was being scanned
+                        entries[key] = entry
+                for key, (mtime, size) in on_disk.items():
+                    if key not in entries:
+                        entries[key] = _CacheEntry(mtime, size)
+                shard.cache = OrderedDict(sorted(entries.items(), key=lambda item: item[1].timestamp))
+                shard.total_bytes = sum(entry.size for entry in entries.values())
+
+    def _compact_journal(self):
+        """Rewrite the journal as a snapshot of the current index"""
+        entries = []
+        for shard in self.shards:
+            with shard.lock:
+                entries.extend((key, entry.timestamp, entry.size) for key, entry in shard.cache.items())
+        entries.sort(key=lambda item: item[1])
+        self.journal.compact(entries)
+
+    def _maybe_compact_journal(self):
+        """Compact the journal once it is dominated by stale records"""
+        if self.journal.records > 4 * self._entry_count() + 1000:
+            self._compact_journal()
+
+    def _write_blob(self, content_hash, pdf_content=None, source_path=None):
+        """Write a PDF to the cache directory atomically, from bytes or by copying source_path"""
+        cache_path = self._get_cache_path(content_hash)
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            if source_path is not None:
+                shutil.copyfile(source_path, tmp_path)
+            else:
+                with open(tmp_path, 'wb') as f:
+                    f.write(pdf_content)
+            os.replace(tmp_path, cache_path)
+        except Exception:
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+            raise
+
+    def _read_blob(self, content_hash):
+        """Read a cached PDF from the cache directory"""
+        with open(self._get_cache_path(content_hash), 'rb') as f:
+            return f.read()
+
+    def _delete_blobs(self, keys):
+        """Delete cached PDF files for removed entries, outside any index lock"""
+        if not self.cache_dir:
+            return
+        for key in keys:
+            self.journal.record_remove(key)
             try:
-                with open(index_path, 'wb') as f:
-                    pickle.dump(self.cache, f)
+                self._get_cache_path(key).unlink()
+            except FileNotFoundError:
+                pass
             except Exception as e:
-                logger.error(f"Failed to save cache index: {str(e)}")
-    
+                logger.error(f"Failed to delete cached file {key}: {str(e)}")
+
+    def _adopt_blob(self, shard, content_hash):
+        """
+        Index a PDF written to the shared cache directory by another process.
+
+        Returns:
+            _CacheEntry: The new index entry, or None if there is no usable blob
+        """
+        try:
+            stat = self._get_cache_path(content_hash).stat()
+        except OSError:
+            return None
+        if time.time() - stat.st_mtime > self.ttl or stat.st_size > self.max_entry_bytes:
+            return None
+
+        entry = _CacheEntry(time.time(), stat.st_size)
+        with shard.lock:
+            existing = shard.cache.get(content_hash)
+            if existing is not None:
+                return existing
+            shard.cache[content_hash] = entry
+            shard.total_bytes += entry.size
+
+        self.journal.record_put(content_hash, entry.timestamp, entry.size)
+        self._delete_blobs([key for key in self._evict() if key != content_hash])
+        return entry
+
     def _get_cache_path(self, content_hash):
         """Get path for a cached PDF file"""
         return Path(self.cache_dir) / f"{content_hash}.pdf"
-    
+
     def _hash_content(self, content):
         """Create a hash of the content for cache lookup"""
-        if isinstance(content, str):
-            content = content.encode('utf-8')
-        return hashlib.sha256(content).hexdigest()
-    
-    def _cleanup(self):
-        """Remove expired entries from cache"""
-        with self.lock:
-            current_time = time.time()
-            expired_keys = [
-                key for key, (timestamp, _) in self.cache.items()
-                if current_time - timestamp > self.ttl
-            ]
-            
-            for key in expired_keys:
-                if key in self.cache:
-                    self._remove_entry(key)
-    
-    def _remove_entry(self, key):
-        """Remove a specific entry from cache"""
-        if key in self.cache:
-            # If using file cache, delete the file
-            if self.cache_dir:
-                try:
-                    cache_path = self._get_cache_path(key)
-                    if cache_path.exists():
-                        cache_path.unlink()
-                except Exception as e:
-                    logger.error(f"Failed to delete cached file {key}: {str(e)}")
-            
-            # Remove from memory cache
-            del self.cache[key]
-    
-    def get(self, content):
+        return hashing.digest(content)
+
+    def key_for(self, content):
+        """Get the cache key for content, to be passed back to get/put"""
+        return self._hash_content(content)
+
+    def _entry_count(self):
+        return sum(len(shard.cache) for shard in self.shards)
+
+    def _total_bytes(self):
+        return sum(shard.total_bytes for shard in self.shards)
+
+    def _expire(self, shard):
+        """
+        Remove expired entries from the front of a shard's LRU order.
+
+        Returns:
+            list: Keys of the removed entries
+        """
+        expired = []
+        cutoff = time.time() - self.ttl
+        with shard.lock:
+            while shard.cache:
+                key, entry = next(iter(shard.cache.items()))
+                if entry.timestamp >= cutoff:
+                    break
+                shard.pop(key)
+                expired.append(key)
+
+        if expired:
+            with self.stats_lock:
+                self.expirations += len(expired)
+        return expired
+
+    def _evict(self):
+        """
+        Evict least recently used entries across shards until the cache fits
+        its entry and byte budgets.
+
+        Returns:
+            list: Keys of the evicted entries
+        """
+        evicted = []
+        with self.evict_lock:
+            while self._entry_count() > self.max_entries or self._total_bytes() > self.max_bytes:
+                # The globally least recently used entry is at the front of one of the shards
+                oldest_shard = None
+                oldest_timestamp = None
+                for shard in self.shards:
+                    timestamp = shard.oldest_timestamp()
+                    if timestamp is not None and (oldest_timestamp is None or timestamp < oldest_timestamp):
+                        oldest_shard, oldest_timestamp = shard, timestamp
+                if oldest_shard is None:
+                    break
+
+                with oldest_shard.lock:
+                    if oldest_shard.cache:
+                        key = next(iter(oldest_shard.cache))
+                        oldest_shard.pop(key)
+                        evicted.append(key)
+
+        if evicted:
+            with self.stats_lock:
+                self.evictions += len(evicted)
+        return evicted
+
+    def get(self, content, content_hash=None):
         """
         Get a PDF from the cache if it exists.
-        
+
         Args:
             content: Content to hash for cache lookup
-            
+            content_hash: Precomputed key from key_for(), skips hashing
+
         Returns:
             bytes: The cached PDF content or None if not found
         """
-        self._cleanup()  # Clean up expired entries
-        
-        content_hash = self._hash_content(content)
-        
-        with self.lock:
-            if content_hash in self.cache:
-                timestamp, _ = self.cache[content_hash]
-                current_time = time.time()
-                
-                # Check if entry is still valid
-                if current_time - timestamp <= self.ttl:
-                    # Update the timestamp to mark as recently used
-                    self.cache[content_hash] = (current_time, None)
-                    
-                    # Load PDF content from file if using file cache
-                    if self.cache_dir:
-                        cache_path = self._get_cache_path(content_hash)
-                        if cache_path.exists():
-                            try:
-                                with open(cache_path, 'rb') as f:
-                                    pdf_content = f.read()
-                                self.hits += 1
-                                logger.info(f"Cache hit: {content_hash[:8]}... ({len(pdf_content)} bytes)")
-                                return pdf_content
-                            except Exception as e:
-                                logger.error(f"Failed to read cached file: {str(e)}")
-                                # If reading fails, remove this entry
-                                self._remove_entry(content_hash)
-                    else:
-                        # Using in-memory cache
-                        _, pdf_content = self.cache[content_hash]
-                        self.hits += 1
-                        logger.info(f"Cache hit: {content_hash[:8]}... ({len(pdf_content)} bytes)")
-                        return pdf_content
+        return self._fetch(content_hash or self._hash_content(content))
+
+    def get_file(self, content_hash, output_path):
+        """
+        Copy a cached PDF to output_path if it exists. The file cache copies it by path
+        without loading it into memory, the counterpart of put_file.
+
+        Args:
+            content_hash: Key from key_for()
+            output_path: Path to write the PDF to
+
+        Returns:
+            bool: True if the PDF was found and written to output_path
+        """
+        return self._fetch(content_hash, output_path) is not None
+
+    def _fetch(self, content_hash, output_path=None):
+        """Look up content_hash, returning the PDF bytes, or output_path once the PDF is copied there"""
+        shard = self._shard(content_hash)
+        self._delete_blobs(self._expire(shard))  # Drop expired entries
+
+        with shard.lock:
+            entry = shard.cache.get(content_hash)
+            if entry is not None:
+                # Mark as recently used
+                entry.timestamp = time.time()
+                shard.cache.move_to_end(content_hash)
+                pdf_content = entry.content
+                if not self.cache_dir:
+                    shard.hits += 1
+
+        if entry is None and self.cache_dir:
+            # Another worker process sharing the cache directory may have cached it
+            entry = self._adopt_blob(shard, content_hash)
+
+        if entry is None:
+            with shard.lock:
+                shard.misses += 1
+            logger.info(f"Cache miss: {content_hash[:8]}...")
+            return None
+
+        if self.cache_dir:
+            self.journal.record_touch(content_hash, entry.timestamp)
+
+            # Load PDF content from file outside the index lock
+            try:
+                if output_path is not None:
+                    shutil.copyfile(self._get_cache_path(content_hash), output_path)
                 else:
-                    # Entry expired
-                    self._remove_entry(content_hash)
-        
-        self.misses += 1
-        logger.info(f"Cache miss: {content_hash[:8]}...")
-        return None
-    
-    def put(self, content, pdf_content):
+                    pdf_content = self._read_blob(content_hash)
+                # The mtime carries the access time to other workers sharing the directory
+                os.utime(self._get_cache_path(content_hash))
+            except Exception as e:
+                if isinstance(e, FileNotFoundError):
+                    logger.info(f"Cached file {content_hash[:8]}... was evicted by another worker")
+                else:
+                    logger.error(f"Failed to read cached file: {str(e)}")
+                # If reading fails, remove this entry (unless it was replaced meanwhile)
+                with shard.lock:
+                    if shard.cache.get(content_hash) is entry:
+                        shard.pop(content_hash)
+                    shard.misses += 1
+                return None
+
+            with shard.lock:
+                shard.hits += 1
+        elif output_path is not None:
+            with open(output_path, 'wb') as f:
+                f.write(pdf_content)
+
+        logger.info(f"Cache hit: {content_hash[:8]}... ({entry.size} bytes)")
+        return output_path if output_path is not None else pdf_content
+
+    def put(self, content, pdf_content, content_hash=None):
         """
         Put a PDF into the cache.
-        
+
         Args:
             content: The content that was converted (for hashing)
             pdf_content: The PDF content to cache
-            
+            content_hash: Precomputed key from key_for(), skips hashing
+
         Returns:
             str: The content hash used for caching
         """
-        self._cleanup()  # Clean up expired entries
-        
-        content_hash = self._hash_content(content)
-        
-        with self.lock:
-            # Check if we need to make room in the cache
-            if len(self.cache) >= self.max_entries:
-                # Find oldest entry
-                oldest_key = min(self.cache.keys(), key=lambda k: self.cache[k][0])
-                self._remove_entry(oldest_key)
-            
-            # Store in cache
-            current_time = time.time()
-            
-            if self.cache_dir:
-                # Store PDF content in file
-                cache_path = self._get_cache_path(content_hash)
-                try:
-                    with open(cache_path, 'wb') as f:
-                        f.write(pdf_content)
-                    
-                    # Store only the timestamp in memory
-                    self.cache[content_hash] = (current_time, None)
-                    self._save_cache_index()
-                except Exception as e:
-                    logger.error(f"Failed to write cached file: {str(e)}")
-                    return content_hash
-            else:
-                # Store in memory
-                self.cache[content_hash] = (current_time, pdf_content)
-            
-            logger.info(f"Cached PDF: {content_hash[:8]}... ({len(pdf_content)} bytes)")
-            return content_hash
-    
+        content_hash = content_hash or self._hash_content(content)
+        self._store(content_hash, len(pdf_content), pdf_content=pdf_content)
+        return content_hash
+
+    def put_file(self, path, content_hash):
+        """
+        Put a PDF file into the cache. The file cache copies it without loading
+        it into memory, so large PDFs can be cached from disk.
+
+        Args:
+            path: Path of the PDF file (left in place)
+            content_hash: Key from key_for()
+
+        Returns:
+            str: The content hash used for caching
+        """
+        self._store(content_hash, os.path.getsize(path), source_path=path)
+        return content_hash
+
+    def _store(self, content_hash, size, pdf_content=None, source_path=None):
+        """Store a PDF given as bytes or as a file path under content_hash, then evict"""
+        # Size-aware admission: one huge PDF must not flush the whole cache
+        if size > self.max_entry_bytes:
+            with self.stats_lock:
+                self.rejections += 1
+            logger.info(f"Not caching PDF {content_hash[:8]}...: {size} bytes exceeds per-entry limit of {self.max_entry_bytes}")
+            return
+
+        shard = self._shard(content_hash)
+        self._delete_blobs(self._expire(shard))  # Drop expired entries
+
+        if self.cache_dir:
+            # Store PDF content in file before publishing it in the index
+            try:
+                self._write_blob(content_hash, pdf_content, source_path)
+            except Exception as e:
+                logger.error(f"Failed to write cached file: {str(e)}")
+                return
+            # Store only the timestamp and size in memory
+            entry = _CacheEntry(time.time(), size)
+        else:
+            # Store in memory
+            if source_path is not None:
+                with open(source_path, 'rb') as f:
+                    pdf_content = f.read()
+            entry = _CacheEntry(time.time(), size, pdf_content)
+
+        with shard.lock:
+            # Replace any existing entry
+            shard.pop(content_hash)
+            shard.cache[content_hash] = entry
+            shard.total_bytes += size
+
+        if self.cache_dir:
+            self.journal.record_put(content_hash, entry.timestamp, size)
+
+        # Make room in the cache, counting what other workers have stored
+        if self.cache_dir:
+            self._sync_with_directory()
+        evicted = self._evict()
+        if content_hash in evicted:
+            # Only possible if the budget is smaller than this entry
+            evicted.remove(content_hash)
+            self._delete_blobs([content_hash])
+        self._delete_blobs(evicted)
+
+        if self.cache_dir:
+            self._maybe_compact_journal()
+
+        logger.info(f"Cached PDF: {content_hash[:8]}... ({size} bytes)")
+
     def get_stats(self):
         """Get cache statistics"""
-        total_requests = self.hits + self.misses
-        hit_rate = (self.hits / total_requests * 100) if total_requests > 0 else 0
-        
+        for shard in self.shards:
+            self._delete_blobs(self._expire(shard))
+
+        hits = sum(shard.hits for shard in self.shards)
+        misses = sum(shard.misses for shard in self.shards)
+        total_requests = hits + misses
+        hit_rate = (hits / total_requests * 100) if total_requests > 0 else 0
+
         return {
-            'size': len(self.cache),
+            'size': self._entry_count(),
             'max_size': self.max_entries,
-            'hits': self.hits,
-            'misses': self.misses,
+            'bytes': self._total_bytes(),
+            'max_bytes': self.max_bytes,
+            'max_entry_bytes': self.max_entry_bytes,
+            'shards': len(self.shards),
+            'hits': hits,
+            'misses': misses,
             'hit_rate': f"{hit_rate:.1f}%",
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'rejections': self.rejections,
             'ttl': self.ttl
         }
-    
+
     def clear(self):
         """Clear all cache entries"""
-        with self.lock:
-            # Remove all cached files
-            if self.cache_dir:
-                for key in list(self.cache.keys()):
-                    cache_path = self._get_cache_path(key)
-                    if cache_path.exists():
-                        try:
-                            cache_path.unlink()
-                        except Exception as e:
-                            logger.error(f"Failed to delete cached file: {str(e)}")
-            
-            # Clear memory cache
-            self.cache.clear()
-            
-            if self.cache_dir:
-                self._save_cache_index()
-            
-            logger.info("PDF cache cleared")
+        removed = []
+        for shard in self.shards:
+            with shard.lock:
+                removed.extend(shard.cache.keys())
+                shard.cache.clear()
+                shard.total_bytes = 0
+
+        # Remove all cached files
+        self._delete_blobs(removed)
+
+        if self.cache_dir:
+            # Including files cached by other worker processes sharing the directory
+            for path in Path(self.cache_dir).glob('*.pdf'):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            self._compact_journal()
+
+        logger.info("PDF cache cleared")
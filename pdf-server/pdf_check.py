@@ -0,0 +1,168 @@
+"""
+PDF validation module for the PDF server.
+PDF attachments are merged as they are instead of being converted, so
+they only get a cheap structural check: a %PDF- header near the start
+and a startxref/%%EOF trailer near the end, without parsing the file.
+Files that mention an /Encrypt dictionary are also opened, to reject the
+ones locked with a user password, which can't be merged. Files that fail
+the check can be repaired: a truncated file gets a new
+cross-reference table built from the objects that survived, then its
+pages are rewritten with PyPDF2.
+"""
+import io
+import logging
+import re
+
+from PyPDF2 import PdfReader, PdfWriter
+
+logger = logging.getLogger(__name__)
+
+# Readers accept the header anywhere in the first 1024 bytes
+HEADER_WINDOW = 1024
+
+# The trailer must be at the end, allowing for trailing whitespace or junk
+TRAILER_WINDOW = 2048
+
+# Start of an indirect object ("12 0 obj") and the catalog dictionary
+OBJECT_PATTERN = re.compile(rb'(?<![0-9])(\d+)\s+(\d+)\s+obj\b')
+CATALOG_PATTERN = re.compile(rb'/Type\s*/Catalog\b')
+
+
+def pdf_problem(content):
+    """
+    Check a PDF's header and trailer.
+
+    Args:
+        content: The PDF file content
+
+    Returns:
+        str: What is wrong with the file, or None if it looks like a complete PDF
+    """
+    if content.find(b'%PDF-', 0, HEADER_WINDOW) < 0:
+        return 'no %PDF- header'
+    tail = content[-TRAILER_WINDOW:]
+    if b'%%EOF' not in tail:
+        return 'no %%EOF marker, the file may be truncated'
+    if b'startxref' not in tail:
+        return 'no startxref in the trailer'
+    return None
+
+
+def pdf_is_locked(content):
+    """
+    Check whether a PDF is encrypted with a password it can't be opened without.
+    Only files containing an /Encrypt entry are parsed.
+
+    Args:
+        content: The PDF file content
+
+    Returns:
+        bool: True if the PDF is encrypted and an empty password doesn't open it
+    """
+    if b'/Encrypt' not in content:
+        return False
+    try:
+        reader = PdfReader(io.BytesIO(content))
+        if not reader.is_encrypted:
+            return False
+        # PasswordType.NOT_DECRYPTED is 0
+        return not reader.decrypt('')
+    except Exception as e:
+        logger.info(f"Encrypted PDF can't be opened: {str(e)}")
+        return True
+
+
+def rebuild_xref(content):
+    """
+    Rebuild the cross-reference table and trailer of a PDF from the objects in its body,
+    dropping a last object cut off by truncation. Objects inside object streams can't be
+    found this way, so PDFs whose catalog is compressed can't be rebuilt.
+
+    Returns:
+        bytes: The PDF with a new xref table and trailer, or None if no catalog was found
+    """
+    start = content.find(b'%PDF-', 0, HEADER_WINDOW)
+    if start < 0:
+        return None
+    body = content[start:]
+
+    # Object number -> (offset, generation), later definitions win as in incremental updates
+    objects = {}
+    starts = [match for match in OBJECT_PATTERN.finditer(body)]
+    end = 0
+    for index, match in enumerate(starts):
+        next_start = starts[index + 1].start() if index + 1 < len(starts) else len(body)
+        endobj = body.rfind(b'endobj', match.end(), next_start)
+        if endobj < 0:
+            continue
+        objects[int(match.group(1))] = (match.start(), int(match.group(2)))
+        end = max(end, endobj + len(b'endobj'))
+
+    root = None
+    for match in CATALOG_PATTERN.finditer(body, 0, end):
+        # The catalog is the object that starts last before its /Type entry
+        owners = [number for number, (offset, _) in objects.items() if offset < match.start()]
+        if owners:
+            root = max(owners, key=lambda number: objects[number][0])
+    if root is None:
+        return None
+
+    output = io.BytesIO()
+    output.write(body[:end])
+    output.write(b'\n')
+    xref_offset = output.tell()
+    size = max(objects) + 1
+    output.write(f"xref\n0 {size}\n".encode('ascii'))
+    output.write(b"0000000000 65535 f \n")
+    for number in range(1, size):
+        if number in objects:
+            offset, generation = objects[number]
+            output.write(f"{offset:010d} {generation:05d} n \n".encode('ascii'))
+        else:
+            output.write(b"0000000000 65535 f \n")
+    output.write(f"trailer\n<< /Size {size} /Root {root} {objects[root][1]} R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode('ascii'))
+    return output.getvalue()
+
+
+def _rewrite_pages(content):
+    """Read a PDF leniently and write its pages to a fresh file, None if that fails"""
+    try:
+        reader = PdfReader(io.BytesIO(content), strict=False)
+        if reader.is_encrypted:
+            logger.warning("Can't repair an encrypted PDF")
+            return None
+
+        writer = PdfWriter()
+        for page in reader.pages:
+            writer.add_page(page)
+        if not writer.pages:
+            return None
+
+        output = io.BytesIO()
+        writer.write(output)
+        return output.getvalue()
+
+    except Exception as e:
+        logger.info(f"Could not rewrite PDF: {str(e)}")
+        return None
+
+
+def repair_pdf(content):
+    """
+    Repair a damaged PDF: rewrite its pages with PyPDF2, rebuilding the
+    cross-reference table first if PyPDF2 can't read the file as it is.
+
+    Args:
+        content: The PDF file content
+
+    Returns:
+        bytes: The repaired PDF, or None if no pages could be recovered
+    """
+    repaired = _rewrite_pages(content)
+    if repaired is None:
+        rebuilt = rebuild_xref(content)
+        if rebuilt is not None:
+            repaired = _rewrite_pages(rebuilt)
+    if repaired is None:
+        logger.warning("PDF repair failed, no readable pages")
+    return repaired
@@ -0,0 +1,205 @@
+"""
+Local PDF merge engine for the PDF server.
+Appends documents to one PyPDF2 writer as they become available, instead
+of uploading every converted PDF to Gotenberg again just to concatenate
+them. Fonts, images and other resources that are byte-for-byte identical
+across documents (the same logo in every attachment, the same embedded
+font in the email and its replies) are written once and shared.
+"""
+import io
+import logging
+
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+from hashing import new_hasher
+
+logger = logging.getLogger(__name__)
+
+# Page resource categories whose entries can be shared between documents
+SHARED_RESOURCE_TYPES = ('/Font', '/XObject', '/ColorSpace', '/ExtGState', '/Pattern', '/Shading')
+
+
+def _supports_shared_resources():
+    """
+    Check for the PyPDF2 writer internals resource sharing relies on: the private
+    per-reader object translation table (_id_translated) and reset_translation().
+    Both exist in PyPDF2 3.0.x, the version pinned in requirements.txt.
+    """
+    writer = PdfWriter()
+    return isinstance(getattr(writer, '_id_translated', None), dict) and hasattr(writer, 'reset_translation')
+
+
+# Without those internals documents are still merged, just without sharing resources
+SHARE_RESOURCES = _supports_shared_resources()
+if not SHARE_RESOURCES:
+    logger.warning("PyPDF2 writer internals changed, merging PDFs without sharing resources")
+
+
+class PdfMergeEngine:
+    """
+    Merges PDFs in order into a single document written to a file.
+    """
+
+    def __init__(self):
+        self.writer = PdfWriter()
+        self.shared = {}        # {resource digest: object number in the writer}
+        self.position = 0       # Number of documents handled so far (appended or skipped)
+        self.appended = 0       # Number of documents appended so far
+        self.skipped = []       # Names of the documents left out because they couldn't be read
+        self.pages = 0
+        self.shared_objects = 0
+        self.failed = False
+
+    def _digest(self, obj, memo, visiting):
+        """
+        Content digest of a PDF object, with indirect references replaced by the digest of
+        what they point to, so identical resources get the same digest in any document.
+        Returns None for objects that can't be shared (anything linked into the page tree).
+        """
+        if isinstance(obj, IndirectObject):
+            if obj.idnum in memo:
+                return memo[obj.idnum]
+            if obj.idnum in visiting:
+                return None
+            target = obj.get_object()
+            if target is None:
+                return None
+            visiting.add(obj.idnum)
+            digest = self._digest(target, memo, visiting)
+            visiting.discard(obj.idnum)
+            memo[obj.idnum] = digest
+            return digest
+
+        hasher = new_hasher()
+        hasher.update(type(obj).__name__.encode('ascii'))
+        if isinstance(obj, DictionaryObject):
+            if '/Parent' in obj or obj.get('/Type') in ('/Page', '/Pages'):
+                return None
+            for key in sorted(obj):
+                value = self._digest(obj[key], memo, visiting)
+                if value is None:
+                    return None
+                hasher.update(key.encode('utf-8', 'surrogateescape'))
+                hasher.update(value)
+            if isinstance(obj, StreamObject):
+                data = getattr(obj, '_data', None)
+                if data is None:
+                    return None
+                hasher.update(data if isinstance(data, bytes) else data.encode('latin-1'))
+        elif isinstance(obj, ArrayObject):
+            for item in obj:
+                value = self._digest(item, memo, visiting)
+                if value is None:
+                    return None
+                hasher.update(value)
+        else:
+            hasher.update(repr(obj).encode('utf-8', 'surrogateescape'))
+        return hasher.digest()
+
+    def _resource_digests(self, reader):
+        """Digest every indirect object reachable from the page resources, {object number: digest}"""
+        memo = {}
+        for page in reader.pages:
+            resources = page.get('/Resources')
+            if resources is None:
+                continue
+            if isinstance(resources, IndirectObject):
+                self._digest(resources, memo, set())
+            for resource_type in SHARED_RESOURCE_TYPES:
+                entries = resources.get_object().get(resource_type)
+                if entries is None:
+                    continue
+                for value in entries.get_object().values():
+                    if isinstance(value, IndirectObject):
+                        self._digest(value, memo, set())
+        return {idnum: digest for idnum, digest in memo.items() if digest is not None}
+
+    def append(self, pdf_content):
+        """
+        Append all pages of a PDF.
+
+        Args:
+            pdf_content: The PDF file content
+
+        Returns:
+            bool: True if appended, False if not. A PDF that can't be read (damaged, or
+            locked with a password) is skipped; a failure while writing its pages to the
+            merged document marks the engine failed.
+        """
+        # Read everything needed before touching the writer, so a bad PDF can be skipped
+        try:
+            reader = PdfReader(io.BytesIO(pdf_content))
+            if reader.is_encrypted and not reader.decrypt(''):
+                raise ValueError('PDF is password protected')
+            page_count = len(reader.pages)
+            digests = self._resource_digests(reader) if SHARE_RESOURCES else {}
+        except Exception as e:
+            logger.warning(f"✗ Local merge skipped unreadable PDF {self.position + 1}: {str(e)}")
+            return False
+
+        try:
+            if not SHARE_RESOURCES:
+                self.writer.append(reader)
+            else:
+                # Point resources identical to ones already written at the existing objects,
+                # PyPDF2 reuses translated object numbers instead of cloning them again
+                translation = self.writer._id_translated.setdefault(id(reader), {})
+                for idnum, digest in digests.items():
+                    if digest in self.shared:
+                        translation[idnum] = self.shared[digest]
+                        self.shared_objects += 1
+
+                try:
+                    self.writer.append(reader)
+
+                    for idnum, digest in digests.items():
+                        if digest not in self.shared and idnum in translation:
+                            self.shared[digest] = translation[idnum]
+                finally:
+                    # The translation table is keyed by id(reader), which a later reader may reuse
+                    self.writer.reset_translation(reader)
+
+            self.appended += 1
+            self.pages += page_count
+            return True
+
+        except Exception as e:
+            logger.error(f"✗ Local merge could not append PDF {self.position + 1}: {str(e)}")
+            self.failed = True
+            return False
+
+    def append_pending(self, pdf_files):
+        """
+        Append the entries of pdf_files (dicts with 'name' and 'content', in merge order) that
+        haven't been appended yet, so the merge can progress while later PDFs are still converting.
+        Unreadable PDFs are left out and their names recorded in skipped.
+
+        Returns:
+            bool: False if the engine has failed
+        """
+        while not self.failed and self.position < len(pdf_files):
+            pdf_file = pdf_files[self.position]
+            if not self.append(pdf_file['content']) and not self.failed:
+                self.skipped.append(pdf_file.get('name'))
+            self.position += 1
+        return not self.failed
+
+    def write(self, output_path):
+        """
+        Write the merged PDF to output_path.
+
+        Returns:
+            bool: True if written
+        """
+        if self.failed or not self.appended:
+            return False
+        try:
+            self.writer.write(output_path)
+            logger.info(f"✓ Merged {self.appended} PDFs locally ({self.pages} pages, {self.shared_objects} shared resources)")
+            if self.skipped:
+                logger.warning(f"Left out of the merged PDF: {', '.join(str(name) for name in self.skipped)}")
+            return True
+        except Exception as e:
+            logger.error(f"✗ Local merge failed to write {output_path}: {str(e)}")
+            return False
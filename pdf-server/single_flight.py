@@ -0,0 +1,141 @@
+"""
+Single-flight de-duplication for the PDF server.
+Concurrent callers converting identical content share one conversion
+instead of each sending a duplicate job to Gotenberg.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class _LeaderAbandoned(Exception):
+    """Set on a shared future when its leader was cancelled, so waiters retry"""
+
+
+class SingleFlight:
+    """
+    In-flight request table keyed by cache hash.
+    The first caller for a key runs the conversion; callers arriving while
+    it is running wait on the same future and receive its result.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inflight = {}  # {key: concurrent.futures.Future}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) once per key among concurrent callers.
+
+        Args:
+            key: De-duplication key (cache hash of the content)
+            fn: Function performing the conversion
+
+        Returns:
+            The result of fn, shared by all callers for the same key.
+            Exceptions raised by fn are re-raised in every waiting caller.
+        """
+        while True:
+            with self.lock:
+                future = self.inflight.get(key)
+                if future is None:
+                    future = self.inflight[key] = concurrent.futures.Future()
+                    self.leaders += 1
+                    leader = True
+                else:
+                    self.coalesced += 1
+                    leader = False
+
+            if leader:
+                return self._lead(key, future, fn, *args, **kwargs)
+
+            logger.info(f"Waiting for in-flight conversion {key[:8]}...")
+            try:
+                return future.result()
+            except _LeaderAbandoned:
+                logger.info(f"In-flight conversion {key[:8]}... was abandoned, retrying")
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """
+        Await fn(*args, **kwargs) once per key among concurrent callers.
+        Shares the in-flight table with do(), so async conversions and
+        conversions on request threads coalesce with each other.
+
+        Args:
+            key: De-duplication key (cache hash of the content)
+            fn: Coroutine function performing the conversion
+
+        Returns:
+            The result of fn, shared by all callers for the same key.
+        """
+        while True:
+            with self.lock:
+                future = self.inflight.get(key)
+                if future is None:
+                    future = self.inflight[key] = concurrent.futures.Future()
+                    self.leaders += 1
+                    leader = True
+                else:
+                    self.coalesced += 1
+                    leader = False
+
+            if leader:
+                try:
+                    result = await fn(*args, **kwargs)
+                except BaseException as e:
+                    self._finish(key, future, exception=e)
+                    raise
+                self._finish(key, future, result=result)
+                return result
+
+            logger.info(f"Waiting for in-flight conversion {key[:8]}...")
+            waiting = asyncio.wrap_future(future)
+            # Mark the outcome retrieved in case this waiter is cancelled before it arrives
+            waiting.add_done_callback(lambda f: f.cancelled() or f.exception())
+            try:
+                # Shielded so a waiter's own cancellation doesn't cancel the shared future
+                return await asyncio.shield(waiting)
+            except _LeaderAbandoned:
+                logger.info(f"In-flight conversion {key[:8]}... was abandoned, retrying")
+
+    def _lead(self, key, future, fn, *args, **kwargs):
+        """Run fn as the leader for key and publish its outcome to the waiters"""
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, future, exception=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    def _finish(self, key, future, result=None, exception=None):
+        """
+        Remove key from the in-flight table, then resolve its future.
+
+        Errors raised by the conversion are shared with the waiters. A leader
+        that was cancelled or interrupted (a BaseException such as
+        CancelledError) says nothing about the content, so its waiters retry
+        and one of them takes over instead of failing with it.
+        """
+        with self.lock:
+            del self.inflight[key]
+        if exception is None:
+            future.set_result(result)
+        elif isinstance(exception, Exception):
+            future.set_exception(exception)
+        else:
+            future.set_exception(_LeaderAbandoned())
+
+    def get_stats(self):
+        """Get de-duplication statistics"""
+        with self.lock:
+            return {
+                'in_flight': len(self.inflight),
+                'conversions': self.leaders,
+                'coalesced': self.coalesced
+            }